@@ -0,0 +1,49 @@
+from collections import OrderedDict
+
+import pygame
+
+TEXT_CACHE_SIZE = 512
+
+__textures = dict()
+__fonts = dict()
+__text = OrderedDict()
+
+def load_texture(path, size=None, alpha=True) -> pygame.Surface:
+    """
+    Loads an image once per process, scaled to size if given. The same surface is handed to everyone who asks, so it
+    should not be drawn on.
+    """
+    key = (path, size, alpha)
+    if key not in __textures:
+        if (path, None, alpha) not in __textures:
+            img = pygame.image.load(path)
+            __textures[(path, None, alpha)] = img.convert_alpha() if alpha else img.convert()
+        img = __textures[(path, None, alpha)]
+        __textures[key] = img if size is None else pygame.transform.scale(img, size)
+    return __textures[key]
+
+def get_font(size, name=None) -> pygame.font.Font:
+    key = (name, size)
+    if key not in __fonts:
+        __fonts[key] = pygame.font.Font(name or pygame.font.get_default_font(), size)
+    return __fonts[key]
+
+def render_text(font, text, colour, antialias=True) -> pygame.Surface:
+    """
+    font.render, but remembers the last TEXT_CACHE_SIZE strings so the same text is not rendered again every frame.
+    """
+    key = (font, text, tuple(colour), antialias)
+    surface = __text.get(key)
+    if surface is None:
+        surface = font.render(text, antialias, colour)
+        __text[key] = surface
+        if len(__text) > TEXT_CACHE_SIZE:
+            __text.popitem(last=False)
+    else:
+        __text.move_to_end(key)
+    return surface
+
+def clear():
+    __textures.clear()
+    __fonts.clear()
+    __text.clear()
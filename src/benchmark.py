@@ -0,0 +1,284 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import json
+import platform
+import random
+import selectors
+import socket
+import statistics
+import subprocess
+import time
+from threading import Thread
+
+import pygame
+
+from common import Game, GameMode, SantaID, GRID_WIDTH, GRID_HEIGHT
+from engine import Engine, Direction
+from protocol import Packet, PacketReader, PROTOCOL_FRAMED, PROTOCOL_BINARY, encode_state, decode_state
+from server import Server
+
+try:
+    import numpy as np
+    from vector_engine import VectorEngine
+except ImportError:
+    VectorEngine = None
+
+"""
+Times the hot paths of the game and writes the results to a JSON file, so runs from different commits can be compared:
+    python benchmark.py --output results.json
+Everything runs offline; pygame uses the dummy video driver so no window is needed.
+"""
+
+DIRECTIONS = list(Direction)
+
+def measure(function, setup=None, min_time=0.2, min_runs=5) -> dict:
+    times = list()
+    start = time.perf_counter()
+    while len(times) < min_runs or time.perf_counter() - start < min_time:
+        if setup is not None:
+            setup()
+        before = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - before)
+    return {
+        "runs": len(times),
+        "mean_us": statistics.fmean(times) * 1e6,
+        "median_us": statistics.median(times) * 1e6,
+        "min_us": min(times) * 1e6,
+    }
+
+def make_engine(num_santas, num_gifts, seed=0, engine_class=Engine, side=None) -> Engine:
+    if side is None:
+        side = 1
+        while side * side < max(num_gifts, num_santas) * 2:
+            side *= 2
+    engine = engine_class(side, side, num_gifts, seed=seed)
+    for i in range(num_santas):
+        engine.add_santa(str(i), f"santa {i}")
+    return engine
+
+def bench_engine(santa_counts, gift_counts) -> list:
+    results = list()
+    rng = random.Random(0)
+    for num_santas in santa_counts:
+        for num_gifts in gift_counts:
+            engine = make_engine(num_santas, num_gifts)
+            keys = list(engine.get_santas())
+
+            def turn():
+                engine.collect_gifts()
+                engine.apply_directions([(key, rng.choice(DIRECTIONS)) for key in keys])
+
+            results.append({"santas": num_santas, "gifts": num_gifts, **measure(turn)})
+    return results
+
+def bench_vector_engine(cases) -> list:
+    results = list()
+    rng = np.random.default_rng(0)
+    for num_santas, side, num_gifts in cases:
+        engine = make_engine(num_santas, num_gifts, engine_class=VectorEngine, side=side)
+        keys = list(engine.get_santas())
+        codes = rng.integers(0, 4, size=(64, num_santas))
+        turn = 0
+
+        def array_turn():
+            nonlocal turn
+            engine.collect_gifts()
+            engine.move_all(codes[turn % len(codes)])
+            turn += 1
+
+        def list_turn():
+            engine.collect_gifts()
+            engine.apply_directions([(key, DIRECTIONS[code]) for key, code in zip(keys, codes[0].tolist())])
+
+        results.append({
+            "santas": num_santas, "side": side, "gifts": num_gifts,
+            "move_all": measure(array_turn), "apply_directions": measure(list_turn)
+        })
+    return results
+
+class BenchGame(Game):
+    """
+    A game whose santas answer instantly with random moves, so every update() plays a whole turn.
+    """
+    def __init__(self, num_santas):
+        engine = Engine(GRID_WIDTH, GRID_HEIGHT, GRID_WIDTH * GRID_HEIGHT // 2, seed=0)
+        super().__init__(turn_time=0, turn_deadline=0, fast_tick=True, engine=engine)
+        self.__santa_ids = [SantaID(str(i), f"santa {i}") for i in range(num_santas)]
+        self.__random = random.Random(0)
+
+    def get_santa_ids(self) -> list[SantaID]:
+        return self.__santa_ids
+
+    def request_santas(self) -> None:
+        pass
+
+    def received_santas(self) -> bool:
+        return True
+
+    def get_santas(self) -> list[tuple[str, Direction]]:
+        return [(santa_id.ip, self.__random.choice(DIRECTIONS)) for santa_id in self.__santa_ids]
+
+    def start_server(self):
+        pass
+
+    def lock_server(self):
+        pass
+
+    def stop_server(self):
+        pass
+
+    def get_server_ip(self) -> str:
+        return "BENCHMARK"
+
+def bench_game(santa_counts) -> tuple[list, list]:
+    updates = list()
+    frames = list()
+    for num_santas in santa_counts:
+        game = None
+
+        def new_game():
+            nonlocal game
+            if game is None or game.get_game_mode() != GameMode.PLAYING:
+                game = BenchGame(num_santas)
+                game.start_game()
+                game.render(0)
+
+        # every update plays a turn, so the board is reset whenever the gifts run out
+        updates.append({"santas": num_santas, **measure(lambda: game.update([]), setup=new_game)})
+        frames.append({"santas": num_santas, **measure(lambda: game.render(1 / 60), setup=new_game)})
+    return updates, frames
+
+def bench_protocol(sizes) -> list:
+    results = list()
+    for num_santas, num_gifts in sizes:
+        engine = make_engine(num_santas, num_gifts)
+        game_state = engine.get_game_state("0")
+        result = {"santas": num_santas, "gifts": num_gifts}
+        result["json_dumps"] = measure(lambda: json.dumps(game_state))
+        for name, protocol in (("framed", PROTOCOL_FRAMED), ("binary", PROTOCOL_BINARY)):
+            data = encode_state(game_state, protocol)
+            frame = Packet("PLEASE SEND ME YOUR DIRECTION", data).get_frame()
+            result[name] = {
+                "bytes": len(frame),
+                "encode": measure(lambda: Packet("PLEASE SEND ME YOUR DIRECTION", encode_state(game_state, protocol)).get_frame()),
+                "decode": measure(lambda: decode_state(PacketReader(framed=True).feed(frame)[0].data)),
+            }
+        results.append(result)
+    return results
+
+class LoopbackClients:
+    """
+    num_clients framed connections to the server, all answered from one thread as soon as a request arrives.
+    """
+    def __init__(self, host, port, num_clients):
+        self.__selector = selectors.DefaultSelector()
+        self.__running = True
+        for i in range(num_clients):
+            sock = socket.create_connection((host, port))
+            sock.sendall(Packet("HANDSHAKE", json.dumps({"name": f"client {i}", "protocols": [PROTOCOL_BINARY]})).get_frame())
+            self.__selector.register(sock, selectors.EVENT_READ, PacketReader(framed=True))
+        self.__thread = Thread(target=self.__thread_target, daemon=True)
+        self.__thread.start()
+
+    def __thread_target(self):
+        answer = Packet("DIRECTION", "UP").get_frame()
+        while self.__running:
+            for key, _ in self.__selector.select(timeout=0.1):
+                data = key.fileobj.recv(65536)
+                if not data:
+                    self.__selector.unregister(key.fileobj)
+                    continue
+                for packet in key.data.feed(data):
+                    if packet.header == "PLEASE SEND ME YOUR DIRECTION":
+                        key.fileobj.sendall(answer)
+
+    def close(self):
+        self.__running = False
+        self.__thread.join()
+        for key in list(self.__selector.get_map().values()):
+            key.fileobj.close()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def bench_server(client_counts) -> list:
+    results = list()
+    for num_clients in client_counts:
+        port = free_port()
+        server = Server(host="127.0.0.1", port=port)
+        server.start_server()
+        for _ in range(100):
+            try:
+                clients = LoopbackClients("127.0.0.1", port, num_clients)
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.01)
+
+        while len(server.get_santa_ids()) < num_clients:
+            time.sleep(0.01)
+        server.start_game()
+
+        def round_trip():
+            server.request_santas()
+            while not server.received_santas():
+                pass
+            server.get_santas()
+
+        results.append({"clients": num_clients, **measure(round_trip)})
+        clients.close()
+        server.stop_server()
+    return results
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the engine, protocol, rendering and server.")
+    parser.add_argument("--output", default="benchmark.json", help="file to write the results to")
+    parser.add_argument("--quick", action="store_true", help="use fewer and smaller cases")
+    args = parser.parse_args()
+
+    if args.quick:
+        santa_counts, gift_counts, client_counts = [1, 10], [15, 1000], [1, 10]
+        sizes = [(2, 15), (10, 1000)]
+        vector_cases = [(100, 200, 4000), (1000, 200, 4000)]
+    else:
+        santa_counts, gift_counts, client_counts = [1, 10, 100, 1000], [15, 1000, 100000], [1, 10, 100]
+        sizes = [(2, 15), (10, 1000), (100, 10000)]
+        vector_cases = [(1000, 1000, 100000), (5000, 1000, 100000), (20000, 1000, 100000)]
+
+    results = {
+        "commit": get_commit(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+    }
+
+    print("engine turns...")
+    results["engine_turn"] = bench_engine(santa_counts, gift_counts)
+    if VectorEngine is not None:
+        print("vector engine turns...")
+        results["vector_engine_turn"] = bench_vector_engine(vector_cases)
+    print("game update and render...")
+    results["game_update"], results["game_render"] = bench_game(santa_counts)
+    print("protocol...")
+    results["protocol"] = bench_protocol(sizes)
+    print("server round trips...")
+    results["server_round_trip"] = bench_server(client_counts)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
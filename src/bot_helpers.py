@@ -0,0 +1,182 @@
+import math
+import threading
+
+from engine import Direction
+
+"""
+Things most bots end up writing themselves, done quickly enough to leave time for actual strategy. Import it from
+edit_me.py:
+    from bot_helpers import GiftIndex, owned_gifts, step_towards
+
+    gifts = GiftIndex()
+
+    def take_turn(game_state):
+        gifts.update(game_state)
+        target = gifts.nearest(*game_state["santas"][0])
+        return step_towards(game_state["santas"][0], target)
+
+Distances are Manhattan distances (|dx| + |dy|), which is how many turns it takes a santa to walk between two tiles.
+Ties between equally close points go to the lowest (x, y).
+
+Bots that keep improving their answer can call propose() with the best move so far. If take_turn is still thinking
+when time runs out, multiplayer.py sends the last move proposed instead of a fallback.
+"""
+
+# roughly how many points each bucket should start with
+POINTS_PER_BUCKET = 2
+
+__proposals = dict()
+
+def propose(direction):
+    __proposals[threading.get_ident()] = direction
+
+def take_proposal(thread_id) -> Direction | None:
+    return __proposals.pop(thread_id, None)
+
+def distance(a, b) -> int:
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+def step_towards(position, target) -> Direction | None:
+    if target is None:
+        return None
+    x, y = position
+    tx, ty = target
+    if tx > x:
+        return Direction.RIGHT
+    if tx < x:
+        return Direction.LEFT
+    if ty > y:
+        return Direction.DOWN
+    if ty < y:
+        return Direction.UP
+    return None
+
+class PointIndex:
+    """
+    Points on the board sorted into square buckets, so a search only looks at the buckets near where it starts.
+    """
+    def __init__(self, grid_size, points=(), bucket_size=None):
+        points = [tuple(point) for point in points]
+        width, height = grid_size
+        if bucket_size is None:
+            bucket_size = max(1, round(math.sqrt(width * height * POINTS_PER_BUCKET / max(1, len(points)))))
+        self.grid_size = (width, height)
+        self.__bucket_size = bucket_size
+        self.__columns = (width + bucket_size - 1) // bucket_size
+        self.__rows = (height + bucket_size - 1) // bucket_size
+        self.__buckets: dict[tuple[int, int], set[tuple[int, int]]] = dict()
+        self.__count = 0
+        for point in points:
+            self.add(point)
+
+    def __len__(self):
+        return self.__count
+
+    def __contains__(self, point):
+        bucket = self.__buckets.get(self.__bucket_of(point))
+        return bucket is not None and tuple(point) in bucket
+
+    def __bucket_of(self, point):
+        return point[0] // self.__bucket_size, point[1] // self.__bucket_size
+
+    def add(self, point):
+        point = tuple(point)
+        bucket = self.__buckets.setdefault(self.__bucket_of(point), set())
+        if point not in bucket:
+            bucket.add(point)
+            self.__count += 1
+
+    def remove(self, point) -> bool:
+        point = tuple(point)
+        key = self.__bucket_of(point)
+        bucket = self.__buckets.get(key)
+        if bucket is None or point not in bucket:
+            return False
+        bucket.remove(point)
+        if not bucket:
+            del self.__buckets[key]
+        self.__count -= 1
+        return True
+
+    def points(self) -> list[tuple[int, int]]:
+        return [point for bucket in self.__buckets.values() for point in bucket]
+
+    def __rings(self, x, y):
+        """
+        Yields the points in each ring of buckets around (x, y), with the smallest distance any point in or beyond
+        that ring can be from (x, y).
+        """
+        bx, by = self.__bucket_of((x, y))
+        for r in range(max(self.__columns, self.__rows)):
+            keys = [(bx + dx, by - r) for dx in range(-r, r + 1)]
+            if r:
+                keys += [(bx + dx, by + r) for dx in range(-r, r + 1)]
+                keys += [(bx - r, by + dy) for dy in range(-r + 1, r)]
+                keys += [(bx + r, by + dy) for dy in range(-r + 1, r)]
+            points = [point for key in keys for point in self.__buckets.get(key, ())]
+            yield max(0, (r - 1) * self.__bucket_size + 1), points
+
+    def nearest(self, x, y) -> tuple[int, int] | None:
+        best = None
+        best_key = None
+        for lower_bound, points in self.__rings(x, y):
+            if best_key is not None and best_key[0] < lower_bound:
+                break
+            for point in points:
+                key = (abs(point[0] - x) + abs(point[1] - y), point)
+                if best_key is None or key < best_key:
+                    best, best_key = point, key
+        return best
+
+    def k_nearest(self, x, y, k) -> list[tuple[int, int]]:
+        found = list()
+        for lower_bound, points in self.__rings(x, y):
+            if len(found) >= k and found[k - 1][0] < lower_bound:
+                break
+            found.extend((abs(point[0] - x) + abs(point[1] - y), point) for point in points)
+            found.sort()
+        return [point for _, point in found[:k]]
+
+    def any_within(self, x, y, radius) -> bool:
+        for lower_bound, points in self.__rings(x, y):
+            if lower_bound > radius:
+                return False
+            if any(abs(point[0] - x) + abs(point[1] - y) <= radius for point in points):
+                return True
+        return False
+
+class GiftIndex(PointIndex):
+    """
+    A PointIndex of the gifts that keeps itself up to date between turns. Gifts only ever disappear from under santas,
+    so update() just looks at the tiles the santas are standing on rather than going through every gift again. If the
+    count does not add up (a new game, or a turn was missed) the index is built again from scratch.
+    """
+    def __init__(self, bucket_size=None):
+        super().__init__((0, 0))
+        self.__bucket_size = bucket_size
+
+    def update(self, game_state):
+        gifts = game_state["gifts"]
+        if tuple(game_state["grid_size"]) == self.grid_size and len(self) >= len(gifts):
+            for santa in game_state["santas"]:
+                self.remove(santa)
+            if len(self) == len(gifts):
+                return
+        PointIndex.__init__(self, game_state["grid_size"], gifts, self.__bucket_size)
+
+def owned_gifts(game_state, gifts=None, you=0) -> list[tuple[int, int]]:
+    """
+    The gifts santa number you (yourself by default) is strictly closer to than any other santa is. gifts can be a
+    GiftIndex or any list of positions; it defaults to every gift in the game state.
+    """
+    santas = [tuple(santa) for santa in game_state["santas"]]
+    position = santas[you]
+    rivals = PointIndex(game_state["grid_size"], santas[:you] + santas[you + 1:])
+    if gifts is None:
+        gifts = game_state["gifts"]
+    elif isinstance(gifts, PointIndex):
+        gifts = gifts.points()
+    return [
+        gift for gift in map(tuple, gifts)
+        if not rivals.any_within(gift[0], gift[1], distance(position, gift))
+    ]
@@ -0,0 +1,197 @@
+from collections import OrderedDict
+
+import pygame
+
+from assets import load_texture
+
+"""
+A view onto part of a board too big for the window. The camera remembers which tile is in the middle of the window
+and how far it is zoomed in; everything on the board is drawn relative to it, and only what is in view is drawn.
+
+The snow and grid lines under the board are cut into chunks about CHUNK_PIXELS across, drawn the first time they come
+into view and kept while they are in use, so memory and drawing time depend on the size of the window rather than the
+board. At most MAX_NEW_CHUNKS chunks are drawn in one frame so zooming out does not stall; any others are filled with
+plain colour until a later frame gets to them.
+"""
+
+ZOOM_LEVELS = (0.25, 0.375, 0.5, 0.75, 1.0, 1.5, 2.0)
+CHUNK_PIXELS = 256
+MAX_NEW_CHUNKS = 8
+# what a chunk looks like before it has been drawn
+CHUNK_COLOUR = (235, 240, 245)
+
+class Camera:
+    def __init__(self, view_size, grid_size, tile_size):
+        self.view_width, self.view_height = view_size
+        self.grid_width, self.grid_height = grid_size
+        self.__base_tile_size = tile_size
+        self.__zoom = ZOOM_LEVELS.index(1.0)
+        self.tile_size = tile_size
+        # the tile (in fractions of a tile) in the middle of the view
+        self.__centre_x = self.view_width / tile_size / 2
+        self.__centre_y = self.view_height / tile_size / 2
+        self.following = None
+        # set whenever the view changes, for whoever draws it to clear
+        self.moved = True
+        self.__clamp()
+
+    def __clamp(self):
+        half_width = self.view_width / self.tile_size / 2
+        half_height = self.view_height / self.tile_size / 2
+        # a board smaller than the view sits in the middle of it
+        if half_width * 2 >= self.grid_width:
+            self.__centre_x = self.grid_width / 2
+        else:
+            self.__centre_x = min(max(self.__centre_x, half_width), self.grid_width - half_width)
+        if half_height * 2 >= self.grid_height:
+            self.__centre_y = self.grid_height / 2
+        else:
+            self.__centre_y = min(max(self.__centre_y, half_height), self.grid_height - half_height)
+
+    def get_zoom(self) -> float:
+        return ZOOM_LEVELS[self.__zoom]
+
+    def get_origin(self) -> tuple[int, int]:
+        """
+        Where the top left corner of the view is, in pixels from the top left corner of the board.
+        """
+        return (
+            round(self.__centre_x * self.tile_size - self.view_width / 2),
+            round(self.__centre_y * self.tile_size - self.view_height / 2)
+        )
+
+    def to_screen(self, x, y) -> tuple[int, int]:
+        left, top = self.get_origin()
+        return int(x * self.tile_size) - left, int(y * self.tile_size) - top
+
+    def to_tile(self, screen_x, screen_y) -> tuple[float, float]:
+        left, top = self.get_origin()
+        return (screen_x + left) / self.tile_size, (screen_y + top) / self.tile_size
+
+    def get_visible_cells(self) -> tuple[int, int, int, int]:
+        """
+        The tiles that are at least partly in view, as (left, top, right, bottom) with right and bottom excluded.
+        """
+        left, top = self.get_origin()
+        return (
+            max(0, left // self.tile_size),
+            max(0, top // self.tile_size),
+            min(self.grid_width, -(-(left + self.view_width) // self.tile_size)),
+            min(self.grid_height, -(-(top + self.view_height) // self.tile_size))
+        )
+
+    def pan(self, dx, dy):
+        """
+        Moves the view by (dx, dy) pixels, and stops following anyone.
+        """
+        self.following = None
+        self.__centre_x += dx / self.tile_size
+        self.__centre_y += dy / self.tile_size
+        self.__clamp()
+        self.moved = True
+
+    def centre_on(self, x, y):
+        old = (self.__centre_x, self.__centre_y)
+        self.__centre_x = x + 0.5
+        self.__centre_y = y + 0.5
+        self.__clamp()
+        if (self.__centre_x, self.__centre_y) != old:
+            self.moved = True
+
+    def zoom(self, steps, around=None):
+        """
+        Zooms in (or out, for negative steps) through ZOOM_LEVELS, keeping the point on the screen at around where it
+        is. around defaults to the middle of the view.
+        """
+        zoom = min(max(self.__zoom + steps, 0), len(ZOOM_LEVELS) - 1)
+        if zoom == self.__zoom:
+            return
+        if around is None:
+            around = (self.view_width // 2, self.view_height // 2)
+        x, y = self.to_tile(*around)
+        self.__zoom = zoom
+        self.tile_size = max(1, round(self.__base_tile_size * ZOOM_LEVELS[zoom]))
+        # put the tile that was under around back under it
+        self.__centre_x = x - (around[0] - self.view_width / 2) / self.tile_size
+        self.__centre_y = y - (around[1] - self.view_height / 2) / self.tile_size
+        self.__clamp()
+        self.moved = True
+
+class ChunkCache:
+    """
+    The snow and grid lines of the board, drawn a chunk at a time as the camera needs them.
+    """
+    def __init__(self, texture, grid_size, tile_size, line_colour, line_width):
+        """
+        line_width is how wide the lines are at tile_size; they get thinner as the camera zooms out.
+        """
+        self.__texture = texture
+        self.__base_tile_size = tile_size
+        self.grid_width, self.grid_height = grid_size
+        self.__line_colour = line_colour
+        self.__line_width = line_width
+        self.__chunks: OrderedDict[tuple[int, int, int], pygame.Surface] = OrderedDict()
+        self.pending = False
+
+    def __make_chunk(self, tile_size, chunk_tiles, cx, cy) -> pygame.Surface:
+        left, top = cx * chunk_tiles, cy * chunk_tiles
+        columns = min(chunk_tiles, self.grid_width - left)
+        rows = min(chunk_tiles, self.grid_height - top)
+        chunk = pygame.Surface((columns * tile_size, rows * tile_size))
+        tile = load_texture(self.__texture, (tile_size, tile_size), alpha=False)
+        for y in range(rows):
+            for x in range(columns):
+                chunk.blit(tile, (x * tile_size, y * tile_size))
+
+        # lines go between tiles, so one on the edge of a chunk is half drawn here and half in the next chunk
+        line_width = max(1, round(self.__line_width * tile_size / self.__base_tile_size))
+        height = rows * tile_size
+        width = columns * tile_size
+        for x in range(columns + 1):
+            if 0 < left + x < self.grid_width:
+                pygame.draw.line(chunk, self.__line_colour, (x * tile_size, 0), (x * tile_size, height), line_width)
+        for y in range(rows + 1):
+            if 0 < top + y < self.grid_height:
+                pygame.draw.line(chunk, self.__line_colour, (0, y * tile_size), (width, y * tile_size), line_width)
+        return chunk
+
+    def draw(self, surface, camera) -> int:
+        """
+        Draws the chunks in view onto surface and returns how many there were. pending is set if some could not be
+        drawn yet.
+        """
+        tile_size = camera.tile_size
+        chunk_tiles = max(1, CHUNK_PIXELS // tile_size)
+        chunk_pixels = chunk_tiles * tile_size
+        left, top, right, bottom = camera.get_visible_cells()
+        columns = range(left // chunk_tiles, (right - 1) // chunk_tiles + 1)
+        rows = range(top // chunk_tiles, (bottom - 1) // chunk_tiles + 1)
+
+        # enough for the view twice over; chunks for other zoom levels and far away parts of the board fall out first
+        limit = 2 * (camera.view_width // chunk_pixels + 2) * (camera.view_height // chunk_pixels + 2)
+        made = 0
+        self.pending = False
+        for cy in rows:
+            for cx in columns:
+                key = (tile_size, cx, cy)
+                chunk = self.__chunks.get(key)
+                position = camera.to_screen(cx * chunk_tiles, cy * chunk_tiles)
+                if chunk is None and made >= MAX_NEW_CHUNKS:
+                    size = (min(chunk_tiles, self.grid_width - cx * chunk_tiles) * tile_size,
+                            min(chunk_tiles, self.grid_height - cy * chunk_tiles) * tile_size)
+                    surface.fill(CHUNK_COLOUR, pygame.Rect(position, size))
+                    self.pending = True
+                    continue
+                if chunk is None:
+                    chunk = self.__chunks[key] = self.__make_chunk(tile_size, chunk_tiles, cx, cy)
+                    made += 1
+                else:
+                    self.__chunks.move_to_end(key)
+                surface.blit(chunk, position)
+
+        while len(self.__chunks) > limit:
+            self.__chunks.popitem(last=False)
+        return len(columns) * len(rows)
+
+    def __len__(self):
+        return len(self.__chunks)
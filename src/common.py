@@ -1,23 +1,27 @@
-import random
 from abc import abstractmethod, ABC
 
 import pygame
 from dataclasses import dataclass
 from enum import Enum, auto
+from itertools import product
+
+from assets import load_texture, get_font, render_text
+from camera import Camera, ChunkCache
+from engine import Engine, Direction, TurnTimer, GRID_WIDTH, GRID_HEIGHT, NUM_GIFTS
+from profiler import FrameProfiler
+from replay import ReplayWriter
 
 MOVE_TIME = 1.0
+TURN_TIME = MOVE_TIME
+TURN_DEADLINE = 5.0
+FAST_TICK = False
 GRID_SIZE = 48
-GRID_WIDTH = 20
-GRID_HEIGHT = 16
 LINE_WIDTH = 5
 LINE_COLOUR = (75, 75, 75)
-NUM_GIFTS = 15
-
-class Direction(Enum):
-    UP = "up"
-    DOWN = "down"
-    LEFT = "left"
-    RIGHT = "right"
+# pixels a second the camera moves while W, A, S or D is held
+PAN_SPEED = 800
+# names are left off santas smaller than this many pixels across
+NAME_MIN_TILE = 24
 
 def lerp(a, b, t):
     return a + (b - a) * t
@@ -30,8 +34,8 @@ class Drawable(pygame.sprite.Sprite):
         self.__next_x = self.__x
         self.__next_y = self.__y
         self.__timer = 0
-        img = pygame.image.load(texture).convert_alpha()
-        self.__img = pygame.transform.scale(img, (GRID_SIZE, GRID_SIZE))
+        self.__texture = texture
+        self.__img = load_texture(texture, (GRID_SIZE, GRID_SIZE))
 
     def move_to(self, x_pos, y_pos):
         next_x = x_pos
@@ -64,67 +68,74 @@ class Drawable(pygame.sprite.Sprite):
             self.__x = self.__next_x
             self.__y = self.__next_y
 
+    def is_animating(self):
+        return self.__timer > 0
+
     def get_x(self):
         return self.__next_x
 
     def get_y(self):
         return self.__next_y
 
-    def render(self, delta_time):
+    def get_rect(self):
         x, y = self.get_position()
+        return pygame.Rect(int(x * GRID_SIZE), int(y * GRID_SIZE), GRID_SIZE, GRID_SIZE)
+
+    def draw(self, surface):
+        x, y = self.get_position()
+        surface.blit(self.__img, (int(x * GRID_SIZE), int(y * GRID_SIZE)))
+
+    def draw_in(self, surface, camera):
+        tile_size = camera.tile_size
+        surface.blit(load_texture(self.__texture, (tile_size, tile_size)), camera.to_screen(*self.get_position()))
+
+    def render(self, delta_time):
+        self.draw(pygame.display.get_surface())
         self.advance_timer(delta_time)
-        pygame.display.get_surface().blit(self.__img, (x * GRID_SIZE, y * GRID_SIZE))
 
 class Santa(Drawable):
     def __init__(self, x_pos, y_pos, name):
         super().__init__(x_pos, y_pos, "../res/santa.png")
         self.name = name
-        self.score = 0
-        font_name = pygame.font.get_default_font()
-        font = pygame.font.Font(font_name, int(GRID_SIZE * 0.3125))
-        self.__text = font.render(name, True, (0, 0, 0))
-
-    def __can_move(self, x, y):
-        if not (0 <= self.get_x() + x < GRID_WIDTH):
-            return False
-
-        if not (0 <= self.get_y() + y < GRID_HEIGHT):
-            return False
+        font = get_font(int(GRID_SIZE * 0.3125))
+        self.__text = render_text(font, name, (0, 0, 0))
 
-        return True
-
-    def move(self, direction):
-        if direction == Direction.UP:
-            vector = (0, -1)
-        elif direction == Direction.RIGHT:
-            vector = (1, 0)
-        elif direction == Direction.DOWN:
-            vector = (0, 1)
-        elif direction == Direction.LEFT:
-            vector = (-1, 0)
-        else:
-            vector = (0, 0)
-
-        if self.__can_move(*vector):
-            self.move_by(*vector)
-
-    def render(self, delta_time):
+    def __get_text_rect(self):
         x, y = self.get_position()
-        super().render(delta_time)
+        text_rect = self.__text.get_rect()
 
-        text_x = x * GRID_SIZE + GRID_SIZE // 2 - self.__text.get_rect().width // 2
-        text_y = y * GRID_SIZE + GRID_SIZE + 1
+        text_x = int(x * GRID_SIZE) + GRID_SIZE // 2 - text_rect.width // 2
+        text_y = int(y * GRID_SIZE) + GRID_SIZE + 1
 
         min_x = 1
         min_y = 1
 
-        max_x = GRID_WIDTH * GRID_SIZE - self.__text.get_rect().width - 1
-        max_y = GRID_HEIGHT * GRID_SIZE - self.__text.get_rect().height - 1
+        max_x = GRID_WIDTH * GRID_SIZE - text_rect.width - 1
+        max_y = GRID_HEIGHT * GRID_SIZE - text_rect.height - 1
 
-        pygame.display.get_surface().blit(self.__text, (
+        text_rect.topleft = (
             min(max(min_x, text_x), max_x),
             min(max(min_y, text_y), max_y),
-        ))
+        )
+        return text_rect
+
+    def get_rect(self):
+        return super().get_rect().union(self.__get_text_rect())
+
+    def draw_sprite(self, surface):
+        super().draw(surface)
+
+    def draw_name(self, surface):
+        surface.blit(self.__text, self.__get_text_rect())
+
+    def draw(self, surface):
+        self.draw_sprite(surface)
+        self.draw_name(surface)
+
+    def draw_name_in(self, surface, camera):
+        x, y = camera.to_screen(*self.get_position())
+        tile_size = camera.tile_size
+        surface.blit(self.__text, self.__text.get_rect(midtop=(x + tile_size // 2, y + tile_size + 1)))
 
 @dataclass
 class SantaID:
@@ -151,7 +162,7 @@ class Button:
         pygame.draw.rect(surf, color, self.rect, border_radius=6)
 
         # Draw text
-        text_surf = self.font.render(self.text, True, self.fg)
+        text_surf = render_text(self.font, self.text, self.fg)
         surf.blit(text_surf, text_surf.get_rect(center=self.rect.center))
 
     def update(self, events):
@@ -173,7 +184,7 @@ class GameMode(Enum):
 @dataclass
 class GameState:
     santas: dict[str, Santa]
-    gifts: list[Gift]
+    gifts: dict[tuple[int, int], Gift]
     game_mode: GameMode = GameMode.WAITING
 
 class Game(ABC):
@@ -209,7 +220,21 @@ class Game(ABC):
     def get_server_ip(self) -> str:
         pass
 
-    def __init__(self):
+    def has_players(self) -> bool:
+        """
+        Whether anyone is still playing; the game ends when nobody is.
+        """
+        return True
+
+    def __init__(self, turn_time=TURN_TIME, turn_deadline=TURN_DEADLINE, fast_tick=FAST_TICK, engine=None,
+                 replay_path=None, seed=None):
+        """
+        turn_time is how long to wait after one turn before starting the next, turn_deadline is how long santas have
+        to answer before they are left where they are, and fast_tick starts the next turn as soon as every santa has
+        answered instead of waiting for turn_time. engine can be given to play on a board that was set up elsewhere.
+        If replay_path is given the match is recorded there. seed decides where the gifts and santas start, so the same
+        seed and santas joining in the same order give the same game.
+        """
         window_width = GRID_WIDTH * GRID_SIZE
         window_height = GRID_HEIGHT * GRID_SIZE
 
@@ -217,28 +242,30 @@ class Game(ABC):
         pygame.font.init()
         pygame.display.set_mode((window_width, window_height))
 
-        unique_present_locations = []
-        while len(unique_present_locations) < NUM_GIFTS:
-            rx = random.randint(0, GRID_WIDTH - 1)
-            ry = random.randint(0, GRID_HEIGHT - 1)
-            for existing_gift in unique_present_locations:
-                if existing_gift.get_x() == rx and existing_gift.get_y() == ry:
-                    continue
-            unique_present_locations.append(Gift(rx, ry))
+        self.__engine = engine or Engine(GRID_WIDTH, GRID_HEIGHT, NUM_GIFTS, seed)
+        # boards bigger than the window are shown through a camera that can be moved around
+        self.__camera = None
+        self.__chunks = None
+        grid_size = (self.__engine.grid_width, self.__engine.grid_height)
+        if grid_size[0] > GRID_WIDTH or grid_size[1] > GRID_HEIGHT:
+            self.__camera = Camera((window_width, window_height), grid_size, GRID_SIZE)
+            self.__chunks = ChunkCache("../res/snow.png", grid_size, GRID_SIZE, LINE_COLOUR, LINE_WIDTH)
+        gifts = {position: Gift(*position) for position in self.__engine.get_gifts()}
 
-
-        self.__game_state = GameState(dict(), unique_present_locations, GameMode.WAITING)
-        self.__font = pygame.font.Font(pygame.font.get_default_font(), 25)
-        self.__big_font = pygame.font.Font(pygame.font.get_default_font(), 40)
+        self.__game_state = GameState(dict(), gifts, GameMode.WAITING)
+        self.__font = get_font(25)
+        self.__big_font = get_font(40)
 
         self.__clock = pygame.time.Clock()
+        self.__profiler = FrameProfiler()
         self.__running = False
-        self.__last_turn_ms = pygame.time.get_ticks()
-        self.__awaiting_santas = False
+        self.__turn_deadline = turn_deadline
+        self.__timer = TurnTimer(turn_time, turn_deadline, fast_tick, now=pygame.time.get_ticks() / 1000 + turn_time)
+        self.__replay_path = replay_path
+        self.__replay = None
         self.__start_button = Button(GRID_SIZE, (GRID_HEIGHT - 2) * GRID_SIZE, GRID_SIZE * 3, GRID_SIZE, "START", self.__big_font, (0, 200, 0), (255, 255, 255))
 
-        background_tile_img = pygame.image.load("../res/snow.png").convert()
-        background_tile = pygame.transform.scale(background_tile_img, (GRID_SIZE, GRID_SIZE))
+        background_tile = load_texture("../res/snow.png", (GRID_SIZE, GRID_SIZE), alpha=False)
         self.__background = pygame.surface.Surface((window_width, window_height))
         self.__grid = pygame.surface.Surface((window_width, window_height), pygame.SRCALPHA)
         for y in range(GRID_HEIGHT):
@@ -251,111 +278,395 @@ class Game(ABC):
         for y in range(1, GRID_HEIGHT):
             pygame.draw.line(self.__grid, LINE_COLOUR, (0, y * GRID_SIZE), (window_width, y * GRID_SIZE), LINE_WIDTH)
 
+        # the playing screen only ever redraws the bits that changed, on top of the background and grid drawn once
+        self.__board = self.__background.copy()
+        self.__board.blit(self.__grid, (0, 0))
+        self.__full_redraw = True
+        self.__last_screen = None
+        self.__santa_rects = dict()
+        self.__dirty_rects = list()
+
+    def get_turn_deadline(self) -> float:
+        return self.__turn_deadline
+
+    def get_engine(self) -> Engine:
+        return self.__engine
+
+    def get_profiler(self) -> FrameProfiler:
+        return self.__profiler
+
+    def get_camera(self) -> Camera | None:
+        return self.__camera
+
     def get_gifts(self) -> list[tuple[int, int]]:
-        return [(g.get_x(), g.get_y()) for g in self.__game_state.gifts]
+        return self.__engine.get_gifts()
 
     def get_santa_position(self, ip) -> tuple[int, int]:
-        santa = self.__game_state.santas[ip]
-        return santa.get_x(), santa.get_y()
+        return self.__engine.get_santa_position(ip)
+
+    def get_game_state(self, ip) -> dict:
+        return self.__engine.get_game_state(ip)
+
+    def refresh_board(self):
+        """
+        Jumps every sprite to where the engine says it is, for when the engine has been changed from outside a turn.
+        A finished game goes back to playing if the engine has gifts left again.
+        """
+        self.__game_state.gifts = {position: Gift(*position) for position in self.__engine.get_gifts()}
+        for ip, santa in self.__engine.get_santas().items():
+            sprite = self.__game_state.santas[ip]
+            sprite.move_to(santa.x, santa.y)
+            sprite.advance_timer(MOVE_TIME)
+        if self.__game_state.game_mode == GameMode.FINISHED and not self.__engine.is_finished():
+            self.__game_state.game_mode = GameMode.PLAYING
+        self.__full_redraw = True
 
     def run(self):
         self.__running = True
         self.start_server()
+        profiler = self.__profiler
         while self.__running:
+            profiler.start_frame()
             events = pygame.event.get()
             for event in events:
                 if event.type == pygame.QUIT:
                     self.__running = False
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    self.__full_redraw = True
+            if profiler.handle_events(events):
+                self.__full_redraw = True
+            profiler.mark("events")
 
             delta_time = self.__clock.tick(60) / 1000.0
+            profiler.mark("tick")
+            if self.__camera is not None and self.__game_state.game_mode == GameMode.PLAYING:
+                self.__update_camera(events, delta_time)
+                profiler.mark("events")
 
             self.update(events)
             self.render(delta_time)
+            profiler.end_frame()
 
         self.stop_server()
+        if self.__replay is not None:
+            self.__replay.close()
+
+    def start_game(self):
+        self.lock_server()
+        self.__game_state.game_mode = GameMode.PLAYING
+        for santa_id in self.get_santa_ids():
+            santa = self.__engine.add_santa(santa_id.ip, santa_id.name)
+            self.__game_state.santas[santa_id.ip] = Santa(santa.x, santa.y, santa_id.name)
+        if self.__replay_path is not None:
+            self.__replay = ReplayWriter(self.__replay_path, self.__engine)
+
+    def get_game_mode(self) -> GameMode:
+        return self.__game_state.game_mode
+
+    def __update_camera(self, events, delta_time):
+        """
+        Dragging with the left or right mouse button or holding W, A, S or D moves the camera, the mouse wheel or + and
+        - zoom, F follows the next santa and G stops following.
+        """
+        camera = self.__camera
+        for event in events:
+            if event.type == pygame.MOUSEWHEEL:
+                camera.zoom(event.y, pygame.mouse.get_pos())
+            elif event.type == pygame.MOUSEMOTION and (event.buttons[0] or event.buttons[2]):
+                camera.pan(-event.rel[0], -event.rel[1])
+            elif event.type == pygame.KEYDOWN:
+                if event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+                    camera.zoom(1)
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    camera.zoom(-1)
+                elif event.key == pygame.K_f and self.__game_state.santas:
+                    ips = list(self.__game_state.santas)
+                    following = ips.index(camera.following) + 1 if camera.following in ips else 0
+                    camera.following = ips[following % len(ips)]
+                elif event.key == pygame.K_g:
+                    camera.following = None
+
+        keys = pygame.key.get_pressed()
+        dx = keys[pygame.K_d] - keys[pygame.K_a]
+        dy = keys[pygame.K_s] - keys[pygame.K_w]
+        if dx or dy:
+            camera.pan(dx * PAN_SPEED * delta_time, dy * PAN_SPEED * delta_time)
 
     def __update_waiting(self, events):
         if self.__start_button.update(events):
-            self.lock_server()
-            self.__game_state.game_mode = GameMode.PLAYING
-            for santa_id in self.get_santa_ids():
-                random_x = random.randint(0, GRID_WIDTH - 1)
-                random_y = random.randint(0, GRID_HEIGHT - 1)
-                self.__game_state.santas[santa_id.ip] = Santa(random_x, random_y, santa_id.name)
+            self.start_game()
+
+    def __sync_sprites(self):
+        for ip, santa in self.__engine.get_santas().items():
+            self.__game_state.santas[ip].move_to(santa.x, santa.y)
+
+        for position in self.__engine.get_collected():
+            gift = self.__game_state.gifts.pop(position, None)
+            if gift is not None:
+                self.__dirty_rects.append(gift.get_rect())
 
     def __update_playing(self):
-        if self.__last_turn_ms + MOVE_TIME * 1000 < pygame.time.get_ticks() and not self.__awaiting_santas:
-            remove_gifts = list()
-            for santa in self.__game_state.santas.values():
-                for i, gift in enumerate(self.__game_state.gifts):
-                    if santa.get_x() == gift.get_x() and santa.get_y() == gift.get_y() and not i in remove_gifts:
-                        remove_gifts.append(i)
-                        santa.score += 1
-
-            remove_gifts = sorted(remove_gifts, key=int, reverse=True)
-            for remove_gift in remove_gifts:
-                self.__game_state.gifts.pop(remove_gift)
-
-            if len(self.__game_state.gifts) <= 0:
+        now = pygame.time.get_ticks() / 1000
+        if self.__timer.end_turn(now, self.received_santas()):
+            # santas that missed the deadline are simply not in the list, so they stay where they are
+            directions = self.get_santas()
+            # hopefully this never happens but just in case
+            if len(directions) > len(self.__game_state.santas):
+                directions = directions[:len(self.__game_state.santas)]
+            if self.__replay is not None:
+                self.__replay.record(directions)
+            self.__engine.apply_directions(directions)
+            self.__sync_sprites()
+
+        if self.__timer.is_due(now):
+            self.__engine.collect_gifts()
+            self.__sync_sprites()
+
+            if self.__timer.is_over(self.__engine, self.has_players()):
+                if self.__replay is not None:
+                    self.__replay.close()
                 self.stop_server()
                 self.__game_state.game_mode = GameMode.FINISHED
             else:
+                self.__timer.start_turn(now)
                 self.request_santas()
-                self.__awaiting_santas = True
-
-        if self.__awaiting_santas and self.received_santas():
-            # hopefully this never happens but just in case
-            directions = self.get_santas()
-            if len(directions) > len(self.__game_state.santas):
-                directions = directions[:len(self.__game_state.santas)]
-            for ip, direction in directions:
-                self.__game_state.santas[ip].move(direction)
-
-            self.__awaiting_santas = False
-            self.__last_turn_ms = pygame.time.get_ticks()
 
     def update(self, events):
         if self.__game_state.game_mode == GameMode.WAITING:
             self.__update_waiting(events)
+            self.__profiler.mark("update_waiting")
         elif self.__game_state.game_mode == GameMode.PLAYING:
             self.__update_playing()
+            self.__profiler.mark("update_playing")
+
+    def __get_screen(self):
+        if self.__game_state.game_mode == GameMode.WAITING:
+            names = tuple(santa.name for santa in self.get_santa_ids())
+            return GameMode.WAITING, self.get_server_ip(), names, self.__start_button.hover
+        scores = tuple((santa.name, santa.score) for santa in self.__engine.get_santas().values())
+        return self.__game_state.game_mode, scores
+
+    @staticmethod
+    def __get_cells(rect):
+        for x in range(rect.left // GRID_SIZE, (rect.right - 1) // GRID_SIZE + 1):
+            for y in range(rect.top // GRID_SIZE, (rect.bottom - 1) // GRID_SIZE + 1):
+                yield x, y
+
+    @staticmethod
+    def __merge_rects(rects) -> list[pygame.Rect]:
+        merged = list()
+        for rect in rects:
+            rect = rect.copy()
+            i = 0
+            while i < len(merged):
+                if rect.colliderect(merged[i]):
+                    rect.union_ip(merged.pop(i))
+                    i = 0
+                else:
+                    i += 1
+            merged.append(rect)
+        return merged
+
+    def __render_playing(self, delta_time) -> list[pygame.Rect] | None:
+        """
+        Draws the parts of the board that changed and returns them, or None if the whole screen was drawn.
+        """
+        surface = pygame.display.get_surface()
+        santas = self.__game_state.santas
+        gifts = self.__game_state.gifts
+
+        if self.__full_redraw or self.__last_screen != GameMode.PLAYING:
+            self.__full_redraw = False
+            self.__last_screen = GameMode.PLAYING
+            self.__dirty_rects = list()
+            surface.blit(self.__board, (0, 0))
+            for gift in gifts.values():
+                gift.draw(surface)
+            for ip, santa in santas.items():
+                santa.advance_timer(delta_time)
+                santa.draw_sprite(surface)
+                self.__santa_rects[ip] = santa.get_rect()
+            self.__profiler.count("gifts", len(gifts))
+            self.__profiler.count("santas", len(santas))
+            self.__profiler.mark("sprites")
+            for santa in santas.values():
+                santa.draw_name(surface)
+            self.__profiler.mark("text")
+            return None
+
+        dirty = self.__dirty_rects
+        self.__dirty_rects = list()
+        for ip, santa in santas.items():
+            animating = santa.is_animating()
+            if animating:
+                santa.advance_timer(delta_time)
+            rect = santa.get_rect()
+            old_rect = self.__santa_rects.get(ip)
+            if animating or rect != old_rect:
+                if old_rect is not None:
+                    dirty.append(old_rect)
+                dirty.append(rect)
+                self.__santa_rects[ip] = rect
+
+        if not dirty:
+            return dirty
+        # every pixel has to be in one rect only, or the names drawn over it would be blended in more than once
+        dirty = self.__merge_rects(dirty)
+
+        santa_cells = dict()
+        for ip, rect in self.__santa_rects.items():
+            for cell in self.__get_cells(rect):
+                santa_cells.setdefault(cell, list()).append(ip)
+
+        order = {ip: i for i, ip in enumerate(santas)}
+        drawn = list()
+        num_gifts = 0
+        num_santas = 0
+        for rect in dirty:
+            surface.set_clip(rect)
+            surface.blit(self.__board, rect, rect)
+            overlapping = set()
+            for cell in self.__get_cells(rect):
+                if cell in gifts:
+                    gifts[cell].draw(surface)
+                    num_gifts += 1
+                overlapping.update(santa_cells.get(cell, ()))
+            overlapping = sorted(overlapping, key=order.get)
+            for ip in overlapping:
+                santas[ip].draw_sprite(surface)
+            num_santas += len(overlapping)
+            drawn.append((rect, overlapping))
+        self.__profiler.count("gifts", num_gifts)
+        self.__profiler.count("santas", num_santas)
+        self.__profiler.count("rects", len(dirty))
+        self.__profiler.mark("sprites")
+
+        # names go on top of every sprite
+        for rect, overlapping in drawn:
+            surface.set_clip(rect)
+            for ip in overlapping:
+                santas[ip].draw_name(surface)
+        surface.set_clip(None)
+        self.__profiler.mark("text")
+        return dirty
+
+    def __render_camera(self, delta_time) -> list[pygame.Rect] | None:
+        """
+        Draws what the camera can see if anything in view might have changed. Returns None if it was drawn, or an empty
+        list if not.
+        """
+        surface = pygame.display.get_surface()
+        santas = self.__game_state.santas
+        gifts = self.__game_state.gifts
+        camera = self.__camera
+
+        animating = False
+        for santa in santas.values():
+            if santa.is_animating():
+                santa.advance_timer(delta_time)
+                animating = True
+        if camera.following in santas:
+            camera.centre_on(*santas[camera.following].get_position())
+
+        # gifts that were picked up leave dirty rects behind
+        if not (self.__full_redraw or camera.moved or animating or self.__dirty_rects or self.__chunks.pending):
+            return list()
+        self.__full_redraw = False
+        self.__last_screen = GameMode.PLAYING
+        self.__dirty_rects = list()
+        camera.moved = False
+
+        if camera.grid_width * camera.tile_size < camera.view_width \
+                or camera.grid_height * camera.tile_size < camera.view_height:
+            surface.fill(LINE_COLOUR)
+        self.__profiler.count("chunks", self.__chunks.draw(surface, camera))
+
+        left, top, right, bottom = camera.get_visible_cells()
+        if len(gifts) < (right - left) * (bottom - top):
+            visible_gifts = [gift for (x, y), gift in gifts.items() if left <= x < right and top <= y < bottom]
+        else:
+            visible_gifts = [gifts[cell] for cell in product(range(left, right), range(top, bottom)) if cell in gifts]
+        for gift in visible_gifts:
+            gift.draw_in(surface, camera)
+
+        visible_santas = list()
+        for santa in santas.values():
+            x, y = santa.get_position()
+            if left - 1 < x < right and top - 1 < y < bottom:
+                santa.draw_in(surface, camera)
+                visible_santas.append(santa)
+        self.__profiler.count("gifts", len(visible_gifts))
+        self.__profiler.count("santas", len(visible_santas))
+        self.__profiler.mark("sprites")
+
+        if camera.tile_size >= NAME_MIN_TILE:
+            for santa in visible_santas:
+                santa.draw_name_in(surface, camera)
+        self.__profiler.mark("text")
+        return None
 
     def render(self, delta_time):
+        if self.__game_state.game_mode == GameMode.PLAYING and self.__camera is not None:
+            rects = self.__render_camera(delta_time)
+        elif self.__game_state.game_mode == GameMode.PLAYING:
+            rects = self.__render_playing(delta_time)
+        else:
+            rects = self.__render_screen()
+
+        if self.__profiler.overlay:
+            rect = self.__profiler.draw_overlay(pygame.display.get_surface())
+            if rects is not None:
+                rects.append(rect)
+            if self.__game_state.game_mode == GameMode.PLAYING:
+                # so the board under it is drawn again before the next overlay goes on top
+                self.__dirty_rects.append(rect)
+            self.__profiler.mark("overlay")
+
+        if rects is None:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+        self.__profiler.mark("flip")
+
+    def __render_screen(self) -> list[pygame.Rect] | None:
+        """
+        Draws the waiting or game over screen if it changed. Returns None if it was drawn, or an empty list if not.
+        """
+        screen = self.__get_screen()
+        if screen == self.__last_screen and not self.__full_redraw:
+            return list()
+        self.__last_screen = screen
+        self.__full_redraw = False
+
         pygame.display.get_surface().blit(self.__background, (0, 0))
+        self.__profiler.mark("sprites")
 
         if self.__game_state.game_mode == GameMode.WAITING:
-            title =  self.__big_font.render("Waiting for players:", True, (0, 0, 0))
+            title =  render_text(self.__big_font, "Waiting for players:", (0, 0, 0))
             pygame.display.get_surface().blit(title, (GRID_SIZE, GRID_SIZE))
 
-            server_ip = self.__font.render(f"Server IP: {self.get_server_ip()}", True, (0, 0, 0))
+            server_ip = render_text(self.__font, f"Server IP: {self.get_server_ip()}", (0, 0, 0))
             pygame.display.get_surface().blit(server_ip, (GRID_SIZE, int(2 * GRID_SIZE)))
 
             y = 3 * GRID_SIZE
             for santa in self.get_santa_ids():
-                text = self.__font.render(santa.name, True, (0, 0, 0))
+                text = render_text(self.__font, santa.name, (0, 0, 0))
                 pygame.display.get_surface().blit(text, (int(1.5 * GRID_SIZE), y))
                 y += int(text.get_rect().height * 1.5)
 
             y += GRID_SIZE // 2
 
             self.__start_button.draw(pygame.display.get_surface())
-        elif self.__game_state.game_mode == GameMode.PLAYING:
-            pygame.display.get_surface().blit(self.__grid, (0, 0))
-
-            for gift in self.__game_state.gifts:
-                gift.render(delta_time)
-
-            for santa in self.__game_state.santas.values():
-                santa.render(delta_time)
         elif self.__game_state.game_mode == GameMode.FINISHED:
-            title =  self.__big_font.render("Game Over!", True, (0, 0, 0))
+            title =  render_text(self.__big_font, "Game Over!", (0, 0, 0))
             pygame.display.get_surface().blit(title, (GRID_SIZE, GRID_SIZE))
 
             y = 2 * GRID_SIZE
-            santa_scores = [(santa.name, santa.score) for santa in self.__game_state.santas.values()]
+            santa_scores = [(santa.name, santa.score) for santa in self.__engine.get_santas().values()]
             santa_scores.sort(key=lambda item: item[1], reverse=True)
             for name, score in santa_scores:
-                text = self.__font.render(f"{name}: {score}", True, (0, 0, 0))
+                text = render_text(self.__font, f"{name}: {score}", (0, 0, 0))
                 pygame.display.get_surface().blit(text, (int(1.5 * GRID_SIZE), y))
                 y += int(text.get_rect().height * 1.5)
-        pygame.display.flip()
+        self.__profiler.mark("text")
+        return None
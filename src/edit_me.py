@@ -1,4 +1,4 @@
-from common import Direction
+from engine import Direction
 
 """
 You need to change the server host in order to connect to multiplayer. The IP will be displayed on the board when the game
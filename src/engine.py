@@ -0,0 +1,185 @@
+import random
+from dataclasses import dataclass
+from enum import Enum
+
+GRID_WIDTH = 20
+GRID_HEIGHT = 16
+NUM_GIFTS = 15
+MAX_TURNS = 1000
+
+class Direction(Enum):
+    UP = "up"
+    DOWN = "down"
+    LEFT = "left"
+    RIGHT = "right"
+
+VECTORS = {
+    Direction.UP: (0, -1),
+    Direction.RIGHT: (1, 0),
+    Direction.DOWN: (0, 1),
+    Direction.LEFT: (-1, 0),
+}
+
+def step_position(x, y, direction, grid_width, grid_height):
+    dx, dy = VECTORS.get(direction, (0, 0))
+    if not (0 <= x + dx < grid_width):
+        return x, y
+
+    if not (0 <= y + dy < grid_height):
+        return x, y
+
+    return x + dx, y + dy
+
+@dataclass
+class SantaState:
+    name: str
+    x: int
+    y: int
+    score: int = 0
+
+class Engine:
+    """
+    The rules of the game without any rendering or timing. A turn is:
+        1. collect_gifts() - santas standing on a gift pick it up, returns False once every gift is gone
+        2. get_game_state() for every santa, which is handed to take_turn
+        3. apply_directions() with whatever the santas decided
+    """
+    def __init__(self, grid_width=GRID_WIDTH, grid_height=GRID_HEIGHT, num_gifts=NUM_GIFTS, seed=None):
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.__random = random.Random(seed)
+        self.__santas: dict[str, SantaState] = dict()
+        # keyed by (x, y) so finding a gift on a tile never needs a scan
+        self.__gifts: dict[tuple[int, int], None] = dict()
+        self.__collected: list[tuple[int, int]] = list()
+
+        if num_gifts > grid_width * grid_height:
+            raise ValueError(f"Cannot fit {num_gifts} gifts on a {grid_width}x{grid_height} grid.")
+        for cell in self.__random.sample(range(grid_width * grid_height), num_gifts):
+            self.__gifts[(cell % grid_width, cell // grid_width)] = None
+
+    def add_santa(self, key, name) -> SantaState:
+        random_x = self.__random.randint(0, self.grid_width - 1)
+        random_y = self.__random.randint(0, self.grid_height - 1)
+        santa = SantaState(name, random_x, random_y)
+        self.__santas[key] = santa
+        return santa
+
+    def get_santas(self) -> dict[str, SantaState]:
+        return self.__santas
+
+    def get_gifts(self) -> list[tuple[int, int]]:
+        return list(self.__gifts)
+
+    def get_collected(self) -> list[tuple[int, int]]:
+        return self.__collected
+
+    def get_santa_position(self, key) -> tuple[int, int]:
+        santa = self.__santas[key]
+        return santa.x, santa.y
+
+    def is_finished(self) -> bool:
+        return len(self.__gifts) <= 0
+
+    def collect_gifts(self) -> bool:
+        # if two santas share a tile the one that joined first gets the gift
+        self.__collected = list()
+        for santa in self.__santas.values():
+            position = (santa.x, santa.y)
+            if position in self.__gifts:
+                del self.__gifts[position]
+                self.__collected.append(position)
+                santa.score += 1
+
+        return not self.is_finished()
+
+    def move_santa(self, key, direction):
+        santa = self.__santas[key]
+        x, y = step_position(santa.x, santa.y, direction, self.grid_width, self.grid_height)
+        santa.x, santa.y = x, y
+
+    def set_state(self, santas, gifts):
+        """
+        Puts the board into a saved position. santas is (x, y, score) for every santa, in the order they were added.
+        """
+        for santa, (x, y, score) in zip(self.__santas.values(), santas):
+            santa.x, santa.y, santa.score = x, y, score
+        self.__gifts = dict.fromkeys(tuple(gift) for gift in gifts)
+        self.__collected = list()
+
+    def apply_directions(self, directions):
+        for key, direction in directions:
+            if key in self.__santas:
+                self.move_santa(key, direction)
+
+    def get_game_state(self, key) -> dict:
+        santas = [self.get_santa_position(key)]
+        for other_key, santa in self.__santas.items():
+            if other_key != key:
+                santas.append((santa.x, santa.y))
+
+        return {
+            "grid_size": (self.grid_width, self.grid_height),
+            "santas": santas,
+            "gifts": self.get_gifts()
+        }
+
+    def play(self, take_turns, max_turns=MAX_TURNS) -> int:
+        """
+        Plays the game out as fast as possible. take_turns maps each santa's key to its take_turn function.
+        Returns the number of turns that were played.
+        """
+        turns = 0
+        while self.collect_gifts() and (max_turns is None or turns < max_turns):
+            self.apply_directions([
+                (key, take_turn(self.get_game_state(key))) for key, take_turn in take_turns.items()
+            ])
+            turns += 1
+        return turns
+
+class TurnTimer:
+    """
+    The turn rules shared by Game and the lobby's rooms. A turn ends once every santa has answered or turn_deadline
+    seconds have passed, the next one starts turn_time seconds later (straight away with fast_tick), and the game is
+    over when the gifts run out, nobody is left to play or max_turns turns have been played. now can come from any
+    clock in seconds, as long as it is always the same one.
+    """
+    def __init__(self, turn_time, turn_deadline, fast_tick, max_turns=None, now=0.0):
+        self.turn = 0
+        self.awaiting = False
+        self.__turn_time = turn_time
+        self.__turn_deadline = turn_deadline
+        self.__fast_tick = fast_tick
+        self.__max_turns = max_turns
+        self.__next_turn = now
+        self.__deadline = 0.0
+
+    def end_turn(self, now, answered) -> bool:
+        """
+        Whether the turn being waited for is over, answered being whether every santa has answered it. If it is, the
+        next turn is scheduled.
+        """
+        if not self.awaiting or not (answered or now >= self.__deadline):
+            return False
+        self.awaiting = False
+        self.__next_turn = now if self.__fast_tick else now + self.__turn_time
+        return True
+
+    def is_due(self, now) -> bool:
+        return not self.awaiting and now >= self.__next_turn
+
+    def is_over(self, engine, has_players=True) -> bool:
+        # with nobody left nothing would ever pick up the rest of the gifts
+        return engine.is_finished() or not has_players or \
+            (self.__max_turns is not None and self.turn >= self.__max_turns)
+
+    def start_turn(self, now):
+        self.turn += 1
+        self.awaiting = True
+        self.__deadline = now + self.__turn_deadline
+
+    def get_wake_time(self) -> float:
+        """
+        When the timer next has something to do, if nothing is answered before then.
+        """
+        return self.__deadline if self.awaiting else self.__next_turn
@@ -0,0 +1,460 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+from multiprocessing import Pipe, Process
+
+from engine import Direction
+from logger import configure, WARNING
+from metrics import RollingHistogram
+from protocol import Packet, PacketReader, PROTOCOL_FRAMED, PROTOCOL_BINARY
+
+"""
+Points a swarm of fake clients at a server to see how many it can handle:
+    python loadtest.py --clients 100 200 500 1000 --think exp:0.02 --drop-rate 0.001
+For each number of clients a fresh server is started in its own process (running the same frame loop as server.py at
+--fps, without waiting for the start button and without drawing unless --render is given), the clients join, and after
+--duration seconds of turns the results are printed: turns a second, how long each turn waited for the last answer,
+and how much CPU the server used. To test a server that is already running, give --connect host:port (and --server-pid
+to see its CPU); start the game yourself once the clients have joined.
+
+All the clients run on one asyncio loop in this process. They speak the real protocol but do not look at the board:
+each answers every request with a random direction after a think time drawn from --think, and every turn each client
+has a --drop-rate chance of disconnecting and coming back --reconnect-delay seconds later. Players cannot join a game
+that has started, so a client that comes back mid-game and is turned away watches as a spectator instead (framed
+protocols only). The game therefore shrinks as clients drop: "players" is how many were asked for a direction in an
+average turn and "end" how many were still playing at the end, with a warning when the average falls below
+PLAYERS_WARNING of the clients asked for. The text protocol works but costs the swarm far more than the others, as
+every board is parsed to find where it ends.
+
+Turns are counted from the client side: a turn starts when the first client is asked for a direction and its barrier
+time runs until the last client answers. Server CPU comes from /proc, so it is only shown on Linux.
+"""
+
+DIRECTIONS = list(Direction)
+PROTOCOL_NAMES = {"text": None, "framed": PROTOCOL_FRAMED, "binary": PROTOCOL_BINARY}
+PLAYERS_WARNING = 0.9
+
+def parse_think(spec):
+    """
+    A think time distribution: a number of seconds, const:S, uniform:A:B, exp:MEAN or lognormal:MU:SIGMA.
+    """
+    name, _, rest = spec.partition(":")
+    try:
+        if not rest:
+            value = float(name)
+            return lambda rng: value
+        params = [float(param) for param in rest.split(":")]
+        if name == "const" and len(params) == 1:
+            return lambda rng: params[0]
+        if name == "uniform" and len(params) == 2:
+            return lambda rng: rng.uniform(*params)
+        if name == "exp" and len(params) == 1:
+            return lambda rng: rng.expovariate(1 / params[0]) if params[0] > 0 else 0.0
+        if name == "lognormal" and len(params) == 2:
+            return lambda rng: rng.lognormvariate(*params)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"Bad think time {spec!r}.")
+
+def read_cpu(pid) -> float | None:
+    """
+    Seconds of CPU (user and system) process pid has used so far, or None if /proc cannot tell us.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # the process name is in brackets and can contain spaces, so count fields from after it
+            fields = file.read().rpartition(")")[2].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve(pipe, port, players, turn_time, turn_deadline, fast_tick, side, num_gifts, seed, join_timeout, fps, render):
+    """
+    Runs a server in this process until the game ends or "stop" comes down the pipe, then sends back its metrics.
+    """
+    import pygame
+    from engine import Engine
+    from server import Server
+    from common import GameMode
+
+    configure(WARNING)
+    engine = Engine(side, side, num_gifts, seed)
+    server = Server(turn_time, turn_deadline, fast_tick, "127.0.0.1", port, seed=seed, engine=engine)
+    server.start_server()
+    give_up = time.monotonic() + join_timeout
+    while len(server.get_santa_ids()) < players and time.monotonic() < give_up and not pipe.poll():
+        time.sleep(0.01)
+    server.start_game()
+    pipe.send(len(server.get_santa_ids()))
+
+    clock = pygame.time.Clock()
+    start = time.monotonic()
+    while server.get_game_mode() == GameMode.PLAYING and not pipe.poll():
+        pygame.event.get()
+        delta_time = clock.tick(fps) / 1000.0 if fps else 0.0
+        server.update([])
+        if render:
+            server.render(delta_time)
+    elapsed = time.monotonic() - start
+    server.stop_server()
+
+    summary = server.get_metrics().summary()
+    connections = summary.pop("connections")
+    summary["missed_turns"] = summary.pop("closed")["missed_turns"] + \
+        sum(metrics["missed_turns"] for metrics in connections.values())
+    summary["elapsed"] = elapsed
+    pipe.send(summary)
+
+class TextReader:
+    """
+    The text protocol has no framing, so a big board can arrive in pieces and two packets can arrive together. States
+    are JSON, so one ends where its JSON does; any other packet is taken to be the rest of what has arrived.
+    """
+    def __init__(self):
+        self.__buffer = ""
+        self.__decoder = json.JSONDecoder()
+
+    def feed(self, data) -> list[Packet]:
+        self.__buffer += data.decode()
+        packets = list()
+        while self.__buffer.count("\n", 0, 200) >= 2:
+            time, header, rest = self.__buffer.split("\n", 2)
+            if header == "PLEASE SEND ME YOUR DIRECTION":
+                try:
+                    _, end = self.__decoder.raw_decode(rest)
+                except ValueError:
+                    break
+                data, self.__buffer = rest[:end], rest[end:]
+            else:
+                data, self.__buffer = rest, ""
+            packets.append(Packet(header, data, time))
+        return packets
+
+class SwarmClient(asyncio.Protocol):
+    def __init__(self, swarm, name, spectator):
+        self.__swarm = swarm
+        self.__name = name
+        self.spectator = spectator
+        self.__protocol = swarm.protocol
+        self.__reader = TextReader() if self.__protocol is None else PacketReader(framed=True)
+        self.__transport = None
+        self.__pending = None
+        self.rejected = False
+
+    def connection_made(self, transport):
+        self.__transport = transport
+        if self.__protocol is None:
+            transport.write(Packet("HANDSHAKE", self.__name).get_bytes())
+        else:
+            transport.write(Packet("HANDSHAKE", json.dumps({
+                "name": self.__name,
+                "protocols": [self.__protocol],
+                "delta": self.__swarm.delta,
+                "spectator": self.spectator
+            })).get_frame())
+
+    def data_received(self, data):
+        try:
+            packets = self.__reader.feed(data)
+        except ValueError:
+            self.__transport.close()
+            return
+        for packet in packets:
+            if packet.header == "PLEASE SEND ME YOUR DIRECTION":
+                if self.__pending is not None:
+                    # the server moved on before we answered
+                    self.__pending.cancel()
+                    self.__swarm.late += 1
+                self.__swarm.requested(self)
+                self.__pending = self.__swarm.loop.call_later(self.__swarm.think_time(), self.__answer)
+            elif packet.header == "EXCEPTION":
+                self.rejected = True
+            elif packet.header == "STOP":
+                self.__swarm.stopped()
+
+    def __answer(self):
+        self.__pending = None
+        packet = Packet("DIRECTION", self.__swarm.random.choice(DIRECTIONS).name)
+        self.__transport.write(packet.get_bytes() if self.__protocol is None else packet.get_frame())
+        self.__swarm.answered()
+        if self.__swarm.random.random() < self.__swarm.drop_rate:
+            self.__swarm.drops += 1
+            self.__transport.close()
+
+    def close(self):
+        if self.__transport is not None:
+            self.__transport.close()
+
+    def connection_lost(self, exc):
+        if self.__pending is not None:
+            self.__pending.cancel()
+            self.__pending = None
+        self.__swarm.lost(self)
+
+class Swarm:
+    def __init__(self, host, port, protocol, delta, think, drop_rate, reconnect_delay, seed=None):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.delta = delta
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.loop = None
+        self.__think = think
+        self.__reconnect_delay = reconnect_delay
+        self.__clients = dict()
+        self.__reconnecting = set()
+        self.__running = False
+        self.__stopped = None
+        self.__first_turn = None
+        # the turn going on now: who has been asked, when the first was asked and when the last answered
+        self.__asked = set()
+        self.__turn_start = None
+        self.__last_answer = None
+        self.barrier = RollingHistogram(None)
+        self.turns = 0
+        # players asked, added up over every turn, to see how many are still playing
+        self.asked = 0
+        self.answers = 0
+        self.late = 0
+        self.drops = 0
+        self.reconnects = 0
+        self.rejected = 0
+
+    def think_time(self) -> float:
+        return max(0.0, self.__think(self.random))
+
+    def requested(self, client):
+        now = time.monotonic()
+        if client in self.__asked:
+            self.__close_turn()
+        if not self.__asked:
+            self.__turn_start = now
+        if self.__first_turn is not None and not self.__first_turn.done():
+            self.__first_turn.set_result(now)
+        self.__asked.add(client)
+
+    def answered(self):
+        self.__last_answer = time.monotonic()
+        self.answers += 1
+
+    def __close_turn(self):
+        if self.__last_answer is not None and self.__last_answer >= self.__turn_start:
+            self.barrier.add(self.__last_answer - self.__turn_start)
+            self.turns += 1
+            self.asked += len(self.__asked)
+        self.__asked.clear()
+        self.__last_answer = None
+
+    def stopped(self):
+        if not self.__stopped.is_set():
+            self.__close_turn()
+            self.__stopped.set()
+
+    def lost(self, client):
+        self.__asked.discard(client)
+        name = self.__clients.pop(client, None)
+        if name is None or not self.__running:
+            return
+        spectator = client.spectator
+        if client.rejected:
+            self.rejected += 1
+            if spectator or self.protocol is None:
+                return
+            spectator = True
+        self.reconnects += 1
+
+        async def reconnect():
+            await asyncio.sleep(self.__reconnect_delay)
+            await self.__connect(name, spectator)
+
+        task = self.loop.create_task(reconnect())
+        self.__reconnecting.add(task)
+        task.add_done_callback(self.__reconnecting.discard)
+
+    async def __connect(self, name, spectator=False, attempts=1):
+        for _ in range(attempts):
+            try:
+                _, client = await self.loop.create_connection(lambda: SwarmClient(self, name, spectator), self.host, self.port)
+                self.__clients[client] = name
+                return True
+            except OSError:
+                if not self.__running:
+                    return False
+                await asyncio.sleep(0.05)
+        return False
+
+    async def run(self, num_clients, duration, on_first_turn=None, first_turn_timeout=None) -> dict:
+        """
+        Connects num_clients clients, then measures for duration seconds from the first turn (or until the game ends).
+        on_first_turn is called when the first turn arrives, to start measuring anything else.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.__running = True
+        self.__stopped = asyncio.Event()
+        self.__first_turn = self.loop.create_future()
+        connected = await asyncio.gather(*(self.__connect(f"bot {i}", attempts=100) for i in range(num_clients)))
+
+        try:
+            first_turn = await asyncio.wait_for(self.__first_turn, first_turn_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("The game never started.")
+        if on_first_turn is not None:
+            on_first_turn()
+        turns, answers, late, asked = self.turns, self.answers, self.late, self.asked
+        try:
+            await asyncio.wait_for(self.__stopped.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        self.__close_turn()
+        elapsed = time.monotonic() - first_turn
+
+        self.__running = False
+        return {
+            "connected": sum(connected),
+            # dropped players come back as spectators once the game has started, so this shrinks as clients drop
+            "players": (self.asked - asked) / (self.turns - turns) if self.turns > turns else None,
+            "players_at_end": sum(1 for client in self.__clients if not client.spectator),
+            "elapsed": elapsed,
+            "turns": self.turns - turns,
+            "turns_per_second": (self.turns - turns) / elapsed if elapsed > 0 else None,
+            "barrier": self.barrier.summary(),
+            "answers": self.answers - answers,
+            "late": self.late - late,
+            "drops": self.drops,
+            "reconnects": self.reconnects,
+            "rejected": self.rejected,
+        }
+
+    def close(self):
+        self.__running = False
+        for task in list(self.__reconnecting):
+            task.cancel()
+        for client in list(self.__clients):
+            client.close()
+
+async def measure(swarm, num_clients, duration, pid, pipe, first_turn_timeout):
+    loop = asyncio.get_running_loop()
+    cpu_start = None
+    wall_start = None
+
+    def started():
+        nonlocal cpu_start, wall_start
+        cpu_start, wall_start = read_cpu(pid) if pid else None, time.monotonic()
+
+    try:
+        result = await swarm.run(num_clients, duration, started, first_turn_timeout)
+        cpu_end, wall_end = read_cpu(pid) if pid else None, time.monotonic()
+        if cpu_start is not None and cpu_end is not None:
+            result["server_cpu"] = (cpu_end - cpu_start) / (wall_end - wall_start)
+        if pipe is not None:
+            pipe.send("stop")
+            result["joined"] = await loop.run_in_executor(None, pipe.recv)
+            result["server"] = await loop.run_in_executor(None, pipe.recv)
+    finally:
+        swarm.close()
+    return result
+
+def run_size(args, num_clients) -> dict:
+    pipe = process = None
+    pid = args.server_pid
+    first_turn_timeout = None
+    if args.connect:
+        host, _, port = args.connect.rpartition(":")
+        port = int(port)
+    else:
+        host, port = "127.0.0.1", free_port()
+        pipe, child_pipe = Pipe()
+        process = Process(target=serve, daemon=True, args=(
+            child_pipe, port, num_clients, args.turn_time, args.deadline, not args.no_fast_tick, args.side, args.gifts,
+            args.seed, args.join_timeout, args.fps, args.render
+        ))
+        process.start()
+        pid = process.pid
+        first_turn_timeout = args.join_timeout + 10
+
+    swarm = Swarm(host, port, PROTOCOL_NAMES[args.protocol], args.delta, args.think, args.drop_rate,
+                  args.reconnect_delay, args.seed)
+    try:
+        result = asyncio.run(measure(swarm, num_clients, args.duration, pid, pipe, first_turn_timeout))
+    finally:
+        if process is not None:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+    result["clients"] = num_clients
+    return result
+
+def format_result(result) -> str:
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f}"
+
+    barrier = result["barrier"]
+    server = result.get("server", {})
+    cpu = result.get("server_cpu")
+    missed = server.get("missed_turns", result["late"])
+    players = result["players"]
+    return (
+        f"{result['clients']:>7} {result['connected']:>9} {'-' if players is None else f'{players:.1f}':>7} "
+        f"{result['players_at_end']:>5} {result['turns']:>6} "
+        f"{result['turns_per_second'] or 0:>8.1f} {ms(barrier.get('p50')):>8} {ms(barrier.get('p90')):>8} "
+        f"{ms(barrier.get('p99')):>8} {ms(barrier.get('max')):>8} {'-' if cpu is None else f'{cpu:.0%}':>5} "
+        f"{missed:>7} {result['drops']:>6} {result['rejected']:>8}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a server with a swarm of fake clients.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100], help="numbers of clients to try, in turn")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure each number of clients for")
+    parser.add_argument("--think", type=parse_think, default=parse_think("0"),
+                        help="think time: seconds, const:S, uniform:A:B, exp:MEAN or lognormal:MU:SIGMA")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="chance each client disconnects each turn")
+    parser.add_argument("--reconnect-delay", type=float, default=0.5, help="seconds before a dropped client comes back")
+    parser.add_argument("--protocol", choices=PROTOCOL_NAMES, default="binary")
+    parser.add_argument("--delta", action="store_true", help="ask for deltas instead of the whole board each turn")
+    parser.add_argument("--connect", default=None, help="host:port of a running server to test instead of starting one")
+    parser.add_argument("--server-pid", type=int, default=None, help="process id of that server, to measure its CPU")
+    parser.add_argument("--turn-time", type=float, default=0.0, help="seconds between turns for the started server")
+    parser.add_argument("--deadline", type=float, default=1.0, help="seconds clients have to answer each turn")
+    parser.add_argument("--no-fast-tick", action="store_true", help="wait --turn-time even when everyone has answered")
+    parser.add_argument("--side", type=int, default=256, help="width and height of the board")
+    parser.add_argument("--gifts", type=int, default=20000, help="gifts on the board, enough to last the test")
+    parser.add_argument("--fps", type=int, default=60, help="frame rate the server runs at, like server.py (0 for no limit)")
+    parser.add_argument("--render", action="store_true", help="draw every frame on the server too")
+    parser.add_argument("--join-timeout", type=float, default=30.0, help="seconds the server waits for clients to join")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    print(f"{'clients':>7} {'connected':>9} {'players':>7} {'end':>5} {'turns':>6} {'turns/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'cpu':>5} {'missed':>7} {'drops':>6} {'rejected':>8}")
+    results = list()
+    for num_clients in args.clients:
+        result = run_size(args, num_clients)
+        results.append(result)
+        print(format_result(result), flush=True)
+        players = result["players"]
+        if players is not None and players < PLAYERS_WARNING * num_clients:
+            print(f"  only {players:.1f} of {num_clients} clients were playing on average ({result['players_at_end']} "
+                  f"at the end); dropped players come back as spectators, so lower --drop-rate to test this size",
+                  flush=True)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
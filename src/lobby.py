@@ -0,0 +1,407 @@
+import argparse
+import selectors
+import socket
+import time
+from multiprocessing import Pipe, Process
+from multiprocessing.reduction import send_handle, recv_handle
+
+from common import GameMode, TURN_TIME, TURN_DEADLINE, FAST_TICK
+from engine import Engine, TurnTimer, GRID_WIDTH, GRID_HEIGHT, NUM_GIFTS, MAX_TURNS
+from logger import get_logger, configure, LEVELS
+from protocol import Packet, TurnBroadcast
+from server import Connection, SERVER_PORT, STOP_TIMEOUT, diff_positions, encode_turn, flush_all
+
+"""
+Runs lots of games at once behind one port, for league nights:
+    python lobby.py --workers 4 --room-size 4
+Clients connect to the lobby exactly as they would to server.py. Once a client has sent its HANDSHAKE the lobby puts it
+in a room and hands its socket to the worker process that runs that room, so the lobby itself only ever deals with
+handshakes. Rooms are headless and go WAITING -> PLAYING -> FINISHED like a Game; a room starts as soon as it is full,
+or START_AFTER seconds after its first player joined if there are at least MIN_PLAYERS by then. A room finishes when
+the gifts run out, when every player has left or after MAX_TURNS turns, like Engine.play.
+
+A framed client can name the room it wants with "room" in its HANDSHAKE, so friends end up playing each other.
+Spectators join the room they name, or the room that started last if they do not name one (or the newest room still
+waiting for players, if none has started).
+
+Sockets are passed between processes with multiprocessing.reduction, which needs a Unix-like system.
+"""
+
+ROOM_SIZE = 4
+MIN_PLAYERS = 2
+START_AFTER = 10.0
+
+class Room:
+    """
+    One headless game, played with the same TurnTimer as Game.update but driven by update(now) from a worker.
+    """
+    def __init__(self, room_id, turn_time, turn_deadline, fast_tick, seed=None):
+        self.room_id = room_id
+        self.mode = GameMode.WAITING
+        self.__engine = Engine(GRID_WIDTH, GRID_HEIGHT, NUM_GIFTS, seed)
+        self.__timer = TurnTimer(turn_time, turn_deadline, fast_tick, MAX_TURNS)
+        self.__players: dict[str, Connection] = dict()
+        self.__spectators: list[Connection] = list()
+        self.__directions = dict()
+        self.__awaiting = set()
+        self.__last_positions = list()
+
+    def add_connection(self, connection):
+        if connection.spectator:
+            self.__spectators.append(connection)
+        else:
+            self.__players[connection.get_address()] = connection
+
+    def get_connections(self) -> list[Connection]:
+        return list(self.__players.values()) + self.__spectators
+
+    def start(self):
+        self.mode = GameMode.PLAYING
+        for address, connection in self.__players.items():
+            self.__engine.add_santa(address, connection.get_name())
+
+    def read(self, connection):
+        connection.on_readable()
+        address = connection.get_address()
+        direction = connection.get_direction()
+        if not connection.active:
+            self.remove(connection)
+        elif self.__timer.awaiting and address in self.__awaiting and direction is not None:
+            self.__directions[address] = direction
+
+    def remove(self, connection):
+        self.__players.pop(connection.get_address(), None)
+        if connection in self.__spectators:
+            self.__spectators.remove(connection)
+        self.__awaiting.discard(connection.get_address())
+
+    def update(self, now) -> float | None:
+        """
+        Plays the room up to now. Returns when it next needs updating, or None if it is not playing.
+        """
+        if self.mode != GameMode.PLAYING:
+            return None
+
+        if self.__timer.end_turn(now, len(self.__directions) >= len(self.__awaiting)):
+            # santas that missed the deadline are simply not in the list, so they stay where they are
+            self.__engine.apply_directions(list(self.__directions.items()))
+            self.__directions = dict()
+            self.__awaiting = set()
+
+        if self.__timer.is_due(now):
+            self.__engine.collect_gifts()
+            if self.__timer.is_over(self.__engine, bool(self.__players)):
+                self.__finish()
+                return None
+            self.__timer.start_turn(now)
+            self.__request_santas()
+
+        return self.__timer.get_wake_time()
+
+    def __request_santas(self):
+        santas = self.__engine.get_santas()
+        indices = {address: i for i, address in enumerate(santas)}
+        players = [connection for address, connection in self.__players.items() if address in santas]
+        self.__awaiting = {connection.get_address() for connection in players}
+
+        positions = [(santa.x, santa.y) for santa in santas.values()]
+        moved = diff_positions(self.__last_positions, positions)
+        removed = [list(gift) for gift in self.__engine.get_collected()]
+        self.__last_positions = positions
+
+        broadcast = TurnBroadcast(self.__timer.turn, (self.__engine.grid_width, self.__engine.grid_height), positions,
+                                  moved, removed, self.__engine.get_gifts)
+        for connection, header, parts in encode_turn(broadcast, players, self.__spectators, indices):
+            if not connection.spectator:
+                connection.metrics.request_sent()
+            connection.send_turn(header, broadcast, parts)
+
+    def __finish(self):
+        self.mode = GameMode.FINISHED
+        for connection in self.get_connections():
+            # a client that is far behind may miss this, but waiting for it would hold up every room in the worker
+            connection.close(Packet("STOP", "thanks"))
+
+    def get_scores(self) -> list[tuple[str, int]]:
+        return [(santa.name, santa.score) for santa in self.__engine.get_santas().values()]
+
+def run_worker(pipe, turn_time, turn_deadline, fast_tick, seed=None):
+    """
+    The body of a worker process. Rooms and clients arrive down the pipe from the lobby, and the scores of every room
+    that finishes go back up it. With a seed, room n is played with seed + n.
+    """
+    # the lobby's writer thread did not come across with the fork
+    configure(get_logger().level)
+    selector = selectors.DefaultSelector()
+    selector.register(pipe, selectors.EVENT_READ)
+    rooms: dict[int, Room] = dict()
+    wake_times: dict[int, float] = dict()
+    finished = set()
+    # connections with something left to send
+    pending = set()
+
+    while True:
+        timeout = None
+        if wake_times:
+            timeout = max(0.0, min(wake_times.values()) - time.monotonic())
+
+        touched = set()
+        for key, events in selector.select(timeout):
+            if key.fileobj is pipe:
+                message = pipe.recv()
+                if message[0] == "stop":
+                    connections = [connection for room in rooms.values() for connection in room.get_connections()]
+                    for connection in connections:
+                        connection.send_packet(Packet("STOP", "thanks"))
+                    flush_all(connections, STOP_TIMEOUT)
+                    for connection in connections:
+                        connection.close()
+                    selector.close()
+                    return
+                if message[0] == "join":
+                    _, room_id, address, handoff = message
+                    sock = socket.socket(fileno=recv_handle(pipe))
+                    if room_id in finished:
+                        # a spectator that turned up just as the game ended
+                        Connection.from_handoff(sock, address, turn_deadline, handoff).close(
+                            Packet("EXCEPTION", "That game has finished."))
+                        continue
+                    if room_id not in rooms:
+                        rooms[room_id] = Room(room_id, turn_time, turn_deadline, fast_tick,
+                                              None if seed is None else seed + room_id)
+                    connection = Connection.from_handoff(sock, address, turn_deadline, handoff)
+                    connection.on_pending = pending.add
+                    rooms[room_id].add_connection(connection)
+                    selector.register(connection, selectors.EVENT_READ, rooms[room_id])
+                    # the lobby may not have finished sending the handshake reply
+                    if connection.has_output():
+                        pending.add(connection)
+                elif message[0] == "start":
+                    rooms[message[1]].start()
+                    touched.add(message[1])
+            else:
+                room, connection = key.data, key.fileobj
+                if events & selectors.EVENT_READ:
+                    room.read(connection)
+                    touched.add(room.room_id)
+                if connection.active and events & selectors.EVENT_WRITE:
+                    connection.flush()
+                    pending.add(connection)
+                if not connection.active:
+                    selector.unregister(connection)
+
+        now = time.monotonic()
+        touched.update(room_id for room_id, wake_time in wake_times.items() if wake_time <= now)
+        for room_id in touched:
+            room = rooms[room_id]
+            wake_time = room.update(now)
+            if wake_time is not None:
+                wake_times[room_id] = wake_time
+            else:
+                wake_times.pop(room_id, None)
+
+            if room.mode == GameMode.FINISHED:
+                for connection in room.get_connections():
+                    try:
+                        selector.unregister(connection)
+                    except KeyError:
+                        pass
+                del rooms[room_id]
+                finished.add(room_id)
+                pipe.send(("finished", room_id, room.get_scores()))
+
+        for connection in pending:
+            if not connection.active:
+                continue
+            room = selector.get_key(connection).data
+            if connection.overflowed:
+                connection.close()
+                selector.unregister(connection)
+                room.remove(connection)
+                # the room may have been waiting on it
+                wake_times[room.room_id] = now
+            else:
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.has_output() else 0)
+                selector.modify(connection, events, room)
+        pending.clear()
+
+class Lobby:
+    def __init__(self, host=None, port=SERVER_PORT, workers=1, room_size=ROOM_SIZE, start_after=START_AFTER,
+                 turn_time=TURN_TIME, turn_deadline=TURN_DEADLINE, fast_tick=FAST_TICK, seed=None):
+        self.__host = host or socket.gethostbyname(socket.gethostname())
+        self.__port = port
+        self.__room_size = room_size
+        self.__start_after = start_after
+        self.__turn_deadline = turn_deadline
+        self.__selector = selectors.DefaultSelector()
+        self.__workers = list()
+        for _ in range(workers):
+            pipe, worker_pipe = Pipe()
+            process = Process(target=run_worker, args=(worker_pipe, turn_time, turn_deadline, fast_tick, seed),
+                              daemon=True)
+            self.__workers.append((process, pipe))
+
+        self.__next_room_id = 0
+        self.__room_workers: dict[int, int] = dict()
+        self.__room_names: dict[str, int] = dict()
+        self.__open_rooms: dict[int, list] = dict()
+        # room id -> name of every room that has started and not finished, oldest first
+        self.__running_rooms: dict[int, str | None] = dict()
+        self.__running_names: dict[str, int] = dict()
+        self.__worker_rooms = [0] * workers
+        self.__running = False
+
+    def get_server_ip(self) -> str:
+        return f"{self.__host}:{self.__port}"
+
+    def __new_room(self, name=None) -> int:
+        room_id = self.__next_room_id
+        self.__next_room_id += 1
+        worker = self.__worker_rooms.index(min(self.__worker_rooms))
+        self.__worker_rooms[worker] += 1
+        self.__room_workers[room_id] = worker
+        # [players so far, when the first one joined, name]
+        self.__open_rooms[room_id] = [0, time.monotonic(), name]
+        if name is not None:
+            self.__room_names[name] = room_id
+        return room_id
+
+    def __start_room(self, room_id):
+        _, _, name = self.__open_rooms.pop(room_id)
+        self.__running_rooms[room_id] = name
+        if name is not None:
+            self.__room_names.pop(name, None)
+            self.__running_names[name] = room_id
+        self.__workers[self.__room_workers[room_id]][1].send(("start", room_id))
+        get_logger().info("room %d started", room_id)
+
+    def __choose_room(self, connection) -> int | None:
+        name = connection.room
+        if connection.spectator:
+            if name is not None:
+                room_id = self.__running_names.get(name)
+                return room_id if room_id is not None else self.__room_names.get(name)
+            if self.__running_rooms:
+                return next(reversed(self.__running_rooms))
+            return next(reversed(self.__open_rooms), None)
+
+        if name is not None:
+            room_id = self.__room_names.get(name)
+            return room_id if room_id is not None else self.__new_room(name)
+
+        unnamed = [room_id for room_id, room in self.__open_rooms.items() if room[2] is None]
+        return unnamed[0] if unnamed else self.__new_room()
+
+    def __accept(self, sock):
+        try:
+            conn, addr = sock.accept()
+        except OSError as e:
+            get_logger().error("accept failed: %s", e)
+            return
+        self.__selector.register(Connection(conn, addr, self.__turn_deadline), selectors.EVENT_READ)
+
+    def __read(self, connection):
+        connection.on_readable()
+        if not connection.active:
+            self.__selector.unregister(connection)
+            return
+        if not connection.handshaken:
+            return
+
+        self.__selector.unregister(connection)
+        handoff = connection.get_handoff()
+        room_id = self.__choose_room(connection)
+        if room_id is None:
+            connection.close(Packet("EXCEPTION", "There is no room to watch."))
+            return
+
+        process, pipe = self.__workers[self.__room_workers[room_id]]
+        pipe.send(("join", room_id, connection.get_address_tuple(), handoff))
+        sock = connection.detach()
+        send_handle(pipe, sock.fileno(), process.pid)
+        sock.close()
+
+        if not connection.spectator:
+            room = self.__open_rooms[room_id]
+            room[0] += 1
+            if room[0] >= self.__room_size:
+                self.__start_room(room_id)
+
+    def __check_rooms(self):
+        now = time.monotonic()
+        for room_id, (players, first_join, _) in list(self.__open_rooms.items()):
+            if players >= MIN_PLAYERS and now - first_join >= self.__start_after:
+                self.__start_room(room_id)
+
+    def __finished(self, worker, message):
+        _, room_id, scores = message
+        del self.__room_workers[room_id]
+        self.__worker_rooms[worker] -= 1
+        name = self.__running_rooms.pop(room_id, None)
+        if name is not None and self.__running_names.get(name) == room_id:
+            del self.__running_names[name]
+        get_logger().info("room %d finished: %s", room_id, ", ".join(f"{name} {score}" for name, score in scores))
+
+    def serve_forever(self):
+        for process, _ in self.__workers:
+            process.start()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # AF_INET = internet protocol
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.__host, self.__port))
+        sock.listen(socket.SOMAXCONN)
+        self.__selector.register(sock, selectors.EVENT_READ)
+        for worker, (_, pipe) in enumerate(self.__workers):
+            self.__selector.register(pipe, selectors.EVENT_READ, worker)
+        get_logger().info("lobby listening on %s", self.get_server_ip())
+
+        self.__running = True
+        try:
+            while self.__running:
+                for key, _ in self.__selector.select(timeout=0.5):
+                    try:
+                        if key.fileobj is sock:
+                            self.__accept(sock)
+                        elif isinstance(key.fileobj, Connection):
+                            self.__read(key.fileobj)
+                        else:
+                            self.__finished(key.data, key.fileobj.recv())
+                    except Exception as e:
+                        get_logger().error("lobby loop: %r", e)
+                self.__check_rooms()
+        finally:
+            for process, pipe in self.__workers:
+                pipe.send(("stop",))
+                process.join(5)
+            self.__selector.close()
+            sock.close()
+
+    def stop(self):
+        self.__running = False
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many multiplayer games at once.")
+    parser.add_argument("--workers", type=int, default=1, help="processes to run rooms in")
+    parser.add_argument("--room-size", type=int, default=ROOM_SIZE, help="players per room")
+    parser.add_argument("--start-after", type=float, default=START_AFTER,
+                        help=f"seconds to wait for a room to fill before starting it with at least {MIN_PLAYERS} players")
+    parser.add_argument("--turn-time", type=float, default=TURN_TIME, help="seconds between turns")
+    parser.add_argument("--deadline", type=float, default=TURN_DEADLINE, help="seconds santas have to answer each turn")
+    parser.add_argument("--fast-tick", action="store_true", help="start the next turn as soon as every santa answers")
+    parser.add_argument("--host", default=None, help="address to listen on (default: this machine's address)")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--seed", type=int, default=None, help="seed for the first room (the next gets seed + 1...)")
+    parser.add_argument("--log-level", choices=LEVELS, default="info", help="use debug to see every packet")
+    args = parser.parse_args()
+
+    configure(LEVELS[args.log_level])
+
+    lobby = Lobby(args.host, args.port, args.workers, args.room_size, args.start_after,
+                  args.turn_time, args.deadline, args.fast_tick, args.seed)
+    try:
+        lobby.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
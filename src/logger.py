@@ -0,0 +1,174 @@
+import atexit
+import queue
+import struct
+import sys
+import time
+from threading import Thread, Lock
+
+"""
+Logging that never makes the game wait. Messages are put on a queue with the time they were made and a background
+thread formats and writes them, so a slow terminal only slows the thread. Messages below the current level are thrown
+away before anything is formatted, and messages with a category (like every packet sent or received) are limited to
+RATE_LIMIT a second per category, with a note of how many were dropped.
+
+The event log is a binary file with the full contents of every packet in and out, for looking at afterwards:
+    header: MAGIC | wall clock time the log started (double)
+    event:  seconds since then (double) | direction (1 byte) | address length (2 bytes) | data length (4 bytes) |
+            address | data
+Events are always written, whatever the level and rate limits.
+"""
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+
+RATE_LIMIT = 20
+
+EVENT_MAGIC = b"BSEV"
+EVENT_HEADER = struct.Struct(">4sd")
+EVENT = struct.Struct(">dBHI")
+INCOMING = 0
+OUTGOING = 1
+
+class Logger:
+    def __init__(self, level=INFO, stream=None, rate_limit=RATE_LIMIT, event_log=None):
+        self.level = level
+        self.__stream = stream or sys.stdout
+        self.__rate_limit = rate_limit
+        self.__start = time.monotonic()
+        # category -> [second, messages this second, messages dropped]
+        self.__rates: dict[str, list[int]] = dict()
+        self.__queue = queue.SimpleQueue()
+        self.__event_file = None
+        if event_log is not None:
+            self.__event_file = open(event_log, "wb")
+            self.__event_file.write(EVENT_HEADER.pack(EVENT_MAGIC, time.time()))
+        self.__thread = None
+        self.__lock = Lock()
+
+    def __start_thread(self):
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__thread_target, daemon=True)
+                self.__thread.start()
+
+    def __thread_target(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == "event":
+                    self.__write_event(*item[1:])
+                else:
+                    self.__write_message(*item)
+            except Exception as e:
+                self.__stream.write(f"logging failed: {e}\n")
+        self.__stream.flush()
+        if self.__event_file is not None:
+            self.__event_file.close()
+
+    def __write_message(self, when, level, message, args, dropped):
+        if args:
+            message = message % args
+        if dropped:
+            message += f" ({dropped} similar messages dropped)"
+        self.__stream.write(f"+{when - self.__start:10.3f} {LEVEL_NAMES.get(level, level):7} {message}\n")
+        if self.__queue.empty():
+            self.__stream.flush()
+
+    def __write_event(self, when, direction, address, parts):
+        address = address.encode()
+        parts = [part.encode() if isinstance(part, str) else part for part in parts]
+        length = sum(len(part) for part in parts)
+        self.__event_file.write(EVENT.pack(when - self.__start, direction, len(address), length) + address)
+        self.__event_file.write(b"".join(parts))
+
+    def log(self, level, message, *args, category=None):
+        """
+        message is only formatted with args (using %) on the writer thread, and only if it is going to be written.
+        """
+        if level < self.level:
+            return
+        dropped = 0
+        if category is not None:
+            second = int(time.monotonic())
+            rate = self.__rates.get(category)
+            if rate is None or rate[0] != second:
+                dropped = rate[2] if rate is not None else 0
+                rate = self.__rates[category] = [second, 0, 0]
+            rate[1] += 1
+            if rate[1] > self.__rate_limit:
+                rate[2] += 1
+                return
+        if self.__thread is None:
+            self.__start_thread()
+        self.__queue.put((time.monotonic(), level, message, args, dropped))
+
+    def debug(self, message, *args, category=None):
+        self.log(DEBUG, message, *args, category=category)
+
+    def info(self, message, *args, category=None):
+        self.log(INFO, message, *args, category=category)
+
+    def warning(self, message, *args, category=None):
+        self.log(WARNING, message, *args, category=category)
+
+    def error(self, message, *args, category=None):
+        self.log(ERROR, message, *args, category=category)
+
+    def wants_events(self) -> bool:
+        return self.__event_file is not None
+
+    def event(self, direction, address, parts):
+        """
+        Records a packet in the event log. parts is the list of buffers that made up the packet on the wire.
+        """
+        if self.__event_file is None:
+            return
+        if self.__thread is None:
+            self.__start_thread()
+        self.__queue.put(("event", time.monotonic(), direction, address, parts))
+
+    def close(self):
+        if self.__thread is not None:
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+        elif self.__event_file is not None:
+            self.__event_file.close()
+        self.__event_file = None
+
+def read_events(path):
+    """
+    Yields (wall clock time, direction, address, data) for every event in an event log.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, start = EVENT_HEADER.unpack_from(data)
+    if magic != EVENT_MAGIC:
+        raise ValueError(f"{path} is not an event log.")
+    offset = EVENT_HEADER.size
+    while offset + EVENT.size <= len(data):
+        when, direction, address_length, length = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        address = data[offset:offset + address_length].decode()
+        offset += address_length
+        yield start + when, direction, address, data[offset:offset + length]
+        offset += length
+
+__logger = Logger()
+
+def get_logger() -> Logger:
+    return __logger
+
+def configure(level=INFO, stream=None, rate_limit=RATE_LIMIT, event_log=None) -> Logger:
+    global __logger
+    __logger.close()
+    __logger = Logger(level, stream, rate_limit, event_log)
+    return __logger
+
+atexit.register(lambda: get_logger().close())
@@ -0,0 +1,162 @@
+import csv
+import os
+import statistics
+import time
+from collections import deque
+
+HISTORY_SIZE = 1024
+
+class RollingHistogram:
+    """
+    Keeps the last HISTORY_SIZE samples, which is enough to see how a match is going without growing forever.
+    """
+    def __init__(self, size=HISTORY_SIZE):
+        self.__samples = deque(maxlen=size)
+        self.total = 0
+
+    def add(self, value):
+        self.__samples.append(value)
+        self.total += 1
+
+    def percentile(self, p) -> float | None:
+        samples = sorted(self.__samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+    def summary(self) -> dict:
+        samples = sorted(self.__samples)
+        if not samples:
+            return {"count": self.total}
+        return {
+            "count": self.total,
+            "mean": statistics.fmean(samples),
+            "p50": samples[len(samples) // 2],
+            "p90": samples[min(len(samples) - 1, int(0.9 * len(samples)))],
+            "p99": samples[min(len(samples) - 1, int(0.99 * len(samples)))],
+            "max": samples[-1],
+        }
+
+class ConnectionMetrics:
+    def __init__(self, match_latency=None):
+        self.latency = RollingHistogram()
+        self.__match_latency = match_latency
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.missed_turns = 0
+        self.__request_time = None
+
+    def request_sent(self):
+        self.__request_time = time.monotonic()
+
+    def direction_received(self):
+        if self.__request_time is not None:
+            latency = time.monotonic() - self.__request_time
+            self.latency.add(latency)
+            if self.__match_latency is not None:
+                self.__match_latency.add(latency)
+            self.__request_time = None
+
+    def turn_missed(self):
+        self.missed_turns += 1
+        self.__request_time = None
+
+    def summary(self) -> dict:
+        return {
+            "latency": self.latency.summary(),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "missed_turns": self.missed_turns,
+        }
+
+class MatchMetrics:
+    """
+    Everything the server measures about a match. Times are in seconds.
+        barrier_wait - from the last request being sent to the last direction arriving (or the deadline)
+        encode       - time spent encoding the turn for every client
+        send         - time spent writing the turn to every client
+    Connections that have gone are folded into closed, so reconnecting clients do not add rows forever.
+    """
+    def __init__(self):
+        self.barrier_wait = RollingHistogram()
+        self.encode = RollingHistogram()
+        self.send = RollingHistogram()
+        self.latency = RollingHistogram()
+        self.connections: dict[str, ConnectionMetrics] = dict()
+        self.closed = {"connections": 0, "turns": 0, "missed_turns": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def add_connection(self, address) -> ConnectionMetrics:
+        metrics = ConnectionMetrics(self.latency)
+        self.connections[address] = metrics
+        return metrics
+
+    def remove_connection(self, address):
+        metrics = self.connections.pop(address, None)
+        if metrics is None:
+            return
+        self.closed["connections"] += 1
+        self.closed["turns"] += metrics.latency.total
+        self.closed["missed_turns"] += metrics.missed_turns
+        self.closed["bytes_in"] += metrics.bytes_in
+        self.closed["bytes_out"] += metrics.bytes_out
+
+    def summary(self) -> dict:
+        connections = dict(self.connections)
+        closed = dict(self.closed)
+        return {
+            "barrier_wait": self.barrier_wait.summary(),
+            "encode": self.encode.summary(),
+            "send": self.send.summary(),
+            "latency": self.latency.summary(),
+            "bytes_in": closed["bytes_in"] + sum(metrics.bytes_in for metrics in connections.values()),
+            "bytes_out": closed["bytes_out"] + sum(metrics.bytes_out for metrics in connections.values()),
+            "connections": {address: metrics.summary() for address, metrics in connections.items()},
+            "closed": closed,
+        }
+
+    def get_stragglers(self, percentile=90, count=5) -> list[tuple[str, int, float | None]]:
+        """
+        The connections holding turns up, worst first: (address, missed turns, reply latency at percentile).
+        """
+        stragglers = list()
+        for address, metrics in dict(self.connections).items():
+            latency = metrics.latency.percentile(percentile)
+            if metrics.missed_turns or latency is not None:
+                stragglers.append((address, metrics.missed_turns, latency))
+        stragglers.sort(key=lambda item: (item[1], item[2] or 0.0), reverse=True)
+        return stragglers[:count]
+
+    def write_csv(self, path):
+        """
+        Appends one row per connection, one for the whole match ("*") and one for every connection that has
+        closed ("closed") to a CSV file.
+        """
+        now = time.time()
+        new_file = not os.path.exists(path)
+        with open(path, "a", newline="") as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow([
+                    "time", "connection", "turns", "latency_p50", "latency_p90", "latency_p99", "latency_max",
+                    "missed_turns", "bytes_in", "bytes_out", "barrier_wait_p50", "barrier_wait_p99", "encode_p50",
+                    "send_p50"
+                ])
+
+            def row(name, turns, latency, missed, bytes_in, bytes_out, match=False):
+                writer.writerow([
+                    f"{now:.3f}", name, turns, latency.get("p50"), latency.get("p90"), latency.get("p99"),
+                    latency.get("max"), missed, bytes_in, bytes_out,
+                    self.barrier_wait.percentile(50) if match else None,
+                    self.barrier_wait.percentile(99) if match else None,
+                    self.encode.percentile(50) if match else None,
+                    self.send.percentile(50) if match else None,
+                ])
+
+            summary = self.summary()
+            row("*", self.barrier_wait.total, summary["latency"], None, summary["bytes_in"], summary["bytes_out"], True)
+            closed = summary["closed"]
+            if closed["connections"]:
+                row("closed", closed["turns"], dict(), closed["missed_turns"], closed["bytes_in"], closed["bytes_out"])
+            for address, metrics in dict(self.connections).items():
+                row(address, metrics.latency.total, metrics.latency.summary(), metrics.missed_turns,
+                    metrics.bytes_in, metrics.bytes_out)
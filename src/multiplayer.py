@@ -1,61 +1,185 @@
+import argparse
 import json
+import select
 import socket
+import time
+from threading import Thread, Event
+from bot_helpers import GiftIndex, step_towards, take_proposal
 from edit_me import SERVER_HOST, SERVER_PORT, handshake, take_turn
-from datetime import datetime
-
-class Packet:
-    @staticmethod
-    def get_time():
-        return datetime.now().strftime("%A %d %B %Y %H:%M:%S")
-
-    def __init__(self, header: str, data: str, time=None):
-        if time is None:
-            time = Packet.get_time()
-        self.__time = time
-        self.header = header
-        self.data = data
-
-    def __str__(self):
-        return f"{self.__time}\n{self.header}\n{self.data}"
-
-    @classmethod
-    def from_bytes(cls, bytes):
-        packet_str = bytes.decode()
-        packet_lines = packet_str.split("\n")
-        if len(packet_lines) != 3:
-            raise ValueError("Bad packet.")
-        return cls(packet_lines[1], packet_lines[2], packet_lines[0])
-
-    def get_bytes(self):
-        return str(self).encode()
+from engine import Direction
+from protocol import Packet, PacketReader, StateMirror, PROTOCOLS, PROTOCOL_TEXT, decode_state
+from shared_turns import LocalTurns, SPIN_TIME, SLEEP_TIME
+
+USE_DELTAS = True
+# get turns through shared memory when the server is on this machine and allows it
+USE_SHARED_MEMORY = True
+# how much of the server's deadline take_turn gets; the rest is left for the answer to get there
+THINK_FRACTION = 0.8
 
 def recv_server(conn):
     while True:
         message = conn.recv(1024)
         packet = Packet.from_bytes(message)
 
-def main():
+class BotRunner:
+    """
+    Runs take_turn on its own thread, so the client can keep reading from the server and answer on time even when the
+    bot is slow. A bot that is still busy when the next turn starts is left to finish rather than started again.
+    """
+    def __init__(self, take_turn, wakeup):
+        self.__take_turn = take_turn
+        self.__wakeup = wakeup
+        self.__thread = None
+        self.__turn = None
+        self.__result = None
+        self.__done = Event()
+
+    def busy(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self, turn, game_state) -> bool:
+        if self.busy():
+            return False
+        self.__turn = turn
+        self.__done.clear()
+        self.__thread = Thread(target=self.__thread_target, args=(game_state,), daemon=True)
+        self.__thread.start()
+        return True
+
+    def __thread_target(self, game_state):
+        take_proposal(self.__thread.ident)
+        try:
+            self.__result = self.__take_turn(game_state)
+        except Exception as e:
+            print(f"take_turn failed: {e}")
+            self.__result = None
+        self.__done.set()
+        self.__wakeup.send(b"\0")
+
+    def get_result(self, turn) -> tuple[bool, Direction | None]:
+        """
+        Whether the bot has answered for turn, and its answer (or its last proposal if it has not).
+        """
+        if self.__turn != turn or self.__thread is None:
+            return False, None
+        if self.__done.is_set():
+            return True, self.__result
+        return False, take_proposal(self.__thread.ident)
+
+def fallback(game_state, gifts) -> Direction | None:
+    gifts.update(game_state)
+    position = game_state["santas"][0]
+    return step_towards(position, gifts.nearest(*position))
+
+def main(spectate=False):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # AF_INET = internet protocol
     sock.connect((SERVER_HOST, SERVER_PORT))
-    sock.send(Packet("HANDSHAKE", handshake()).get_bytes())
-    while True:
-        message = sock.recv(1024)
-        if not message:
-            continue
-        packet = Packet.from_bytes(message)
-        if packet.header == "STOP":
-            break
-        if packet.header == "PLEASE SEND ME YOUR DIRECTION":
-            game_state = json.loads(packet.data)
-            direction = take_turn(game_state)
-            if direction is not None:
-                sock.send(Packet(
-                    "DIRECTION",
-                    direction.name
-                ).get_bytes())
+    sock.sendall(Packet("HANDSHAKE", json.dumps({
+        "name": "" if spectate else handshake(),
+        "protocols": [protocol for protocol in PROTOCOLS if protocol != PROTOCOL_TEXT],
+        "delta": USE_DELTAS,
+        "spectator": spectate,
+        "shared_memory": USE_SHARED_MEMORY and not spectate
+    })).get_frame())
+
+    wakeup_recv, wakeup_send = socket.socketpair()
+    runner = BotRunner(take_turn, wakeup_send)
+    gifts = GiftIndex()
+    reader = PacketReader(framed=True)
+    mirror = None
+    local = None
+    budget = None
+    turn = 0
+    # (turn, game state, time to answer by, turn in shared memory or None) while the server is waiting for us
+    pending = None
+
+    def answer(direction):
+        nonlocal pending
+        if direction is None:
+            direction = fallback(pending[1], gifts)
+        if pending[3] is not None:
+            local.answer(pending[3], direction)
+            # tells the server to read the slot now rather than at the deadline
+            sock.sendall(Packet("ANSWERED", "").get_frame())
+        elif direction is not None:
+            sock.sendall(Packet(
+                "DIRECTION",
+                direction.name
+            ).get_frame())
+        pending = None
+
+    def request(game_state, shared_turn=None):
+        nonlocal turn, pending
+        # if we still owe an answer for the last turn it is too late now, the server has moved on
+        turn += 1
+        pending = (turn, game_state, None if budget is None else time.monotonic() + budget, shared_turn)
+        if not runner.start(turn, game_state):
+            answer(None)
+
+    running = True
+    while running:
+        if local is not None:
+            game_state = local.wait(SPIN_TIME if pending is None else 0)
+            if game_state is None:
+                # the server sends WAKE to sleeping bots, so look once more in case a turn came just before this
+                local.set_sleeping(True)
+                game_state = local.poll()
+            if game_state is not None:
+                local.set_sleeping(False)
+                request(game_state, local.turn)
+
+        timeout = None if pending is None or pending[2] is None else max(0.0, pending[2] - time.monotonic())
+        if local is not None:
+            timeout = SLEEP_TIME if timeout is None else min(timeout, SLEEP_TIME)
+        readable, _, _ = select.select([sock, wakeup_recv], [], [], timeout)
+        if wakeup_recv in readable:
+            wakeup_recv.recv(1024)
+
+        if sock in readable:
+            message = sock.recv(65536)
+            if not message:
+                break
+            # the next state is decoded as soon as it arrives, even if the bot is still busy with the last one
+            for packet in reader.feed(message):
+                if packet.header == "STOP":
+                    running = False
+                    break
+                if packet.header == "HANDSHAKE":
+                    handshake_reply = json.loads(packet.data)
+                    if handshake_reply.get("delta", False):
+                        mirror = StateMirror()
+                    if handshake_reply.get("deadline") is not None:
+                        budget = handshake_reply["deadline"] * THINK_FRACTION
+                if packet.header == "STATE" and mirror is not None:
+                    game_state = mirror.apply(packet.data)
+                    print(f"turn {mirror.turn}: {len(game_state['santas'])} santas, {len(game_state['gifts'])} gifts left")
+                if packet.header == "EXCEPTION":
+                    print(packet.data)
+                if packet.header == "SHARED MEMORY":
+                    offer = json.loads(packet.data)
+                    try:
+                        local = LocalTurns(offer["name"], offer["slot"])
+                        # ANSWERED is all that goes back on a turn, so it must not wait for an ACK
+                        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        sock.sendall(Packet("SHARED MEMORY", "ready").get_frame())
+                    except (OSError, ValueError):
+                        # not on the same machine after all, so carry on over the network
+                        local = None
+                if packet.header == "PLEASE SEND ME YOUR DIRECTION":
+                    request(decode_state(packet.data) if mirror is None else mirror.apply(packet.data))
+
+        if pending is not None:
+            finished, direction = runner.get_result(pending[0])
+            if finished or (pending[2] is not None and time.monotonic() >= pending[2]):
+                answer(direction)
 
     sock.close()
+    wakeup_recv.close()
+    wakeup_send.close()
+    if local is not None:
+        local.close()
 
 if __name__ == "__main__":
-    main()
-
+    parser = argparse.ArgumentParser(description="Join a multiplayer game.")
+    parser.add_argument("--spectate", action="store_true", help="watch the game without playing")
+    main(parser.parse_args().spectate)
@@ -0,0 +1,202 @@
+import cProfile
+import io
+import pstats
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import pygame
+
+from assets import get_font
+from logger import get_logger
+
+"""
+Where the time in each frame goes. Game.run marks the end of each phase of a frame as it goes:
+    events          pygame.event.get and handling the events
+    tick            waiting for the next frame, which is time to spare
+    update_waiting  Game.update on the waiting screen
+    update_playing  Game.update during a game
+    sprites         drawing the board, gifts and santas
+    text            drawing names, scores and other text
+    flip            putting the frame on the screen
+    overlay         drawing the overlay below
+Functions added with add_hook are called with the FrameStats of every frame.
+
+In any game window F3 shows an overlay with the frame rate, the average time of each phase over the last HISTORY
+frames and how many sprites were drawn, and F4 runs the next PROFILE_FRAMES frames under cProfile, then writes the
+stats to PROFILE_PATH (open them with pstats or snakeviz) and logs the functions that took the longest.
+"""
+
+PHASES = ("events", "tick", "update_waiting", "update_playing", "sprites", "text", "flip", "overlay")
+HISTORY = 60
+PROFILE_FRAMES = 300
+PROFILE_PATH = "frames.prof"
+OVERLAY_KEY = pygame.K_F3
+PROFILE_KEY = pygame.K_F4
+# seconds between updates of the numbers on the overlay, so they can be read
+OVERLAY_REFRESH = 0.25
+OVERLAY_COLOUR = (255, 255, 255)
+OVERLAY_BACKGROUND = (0, 0, 0)
+
+@dataclass
+class FrameStats:
+    frame: int
+    # seconds, from the start of one frame to the start of the next
+    total: float
+    # seconds spent in each phase
+    phases: dict[str, float]
+    # things drawn, like santas and gifts
+    counts: dict[str, int]
+
+class FrameProfiler:
+    def __init__(self):
+        self.overlay = False
+        self.profile_path = PROFILE_PATH
+        self.__hooks = list()
+        self.__frame = 0
+        self.__start = self.__last = time.perf_counter()
+        self.__phases: dict[str, float] = dict()
+        self.__counts: dict[str, int] = dict()
+        self.__history: deque[FrameStats] = deque(maxlen=HISTORY)
+        self.__profile = None
+        self.__profile_frames = 0
+        self.__overlay_lines = list()
+        self.__overlay_time = 0.0
+        self.__overlay_rect = None
+
+    def add_hook(self, hook):
+        self.__hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.__hooks.remove(hook)
+
+    def start_frame(self):
+        if self.__profile_frames and self.__profile is None:
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        self.__start = self.__last = time.perf_counter()
+
+    def mark(self, phase):
+        """
+        Ends phase: everything since the last mark (or the start of the frame) is counted as time spent in it.
+        """
+        now = time.perf_counter()
+        self.__phases[phase] = self.__phases.get(phase, 0.0) + now - self.__last
+        self.__last = now
+
+    def count(self, name, amount=1):
+        self.__counts[name] = self.__counts.get(name, 0) + amount
+
+    def end_frame(self) -> FrameStats:
+        stats = FrameStats(self.__frame, time.perf_counter() - self.__start, self.__phases, self.__counts)
+        self.__frame += 1
+        self.__phases = dict()
+        self.__counts = dict()
+        self.__history.append(stats)
+        for hook in self.__hooks:
+            hook(stats)
+
+        if self.__profile is not None:
+            self.__profile_frames -= 1
+            if self.__profile_frames <= 0:
+                self.__finish_profile()
+        return stats
+
+    def profile(self, frames=PROFILE_FRAMES):
+        """
+        Runs the next frames frames under cProfile and writes the stats to profile_path.
+        """
+        if self.__profile is None:
+            self.__profile_frames = frames
+
+    def is_profiling(self) -> bool:
+        return self.__profile_frames > 0
+
+    def __finish_profile(self):
+        self.__profile.disable()
+        self.__profile.dump_stats(self.profile_path)
+        stream = io.StringIO()
+        pstats.Stats(self.__profile, stream=stream).sort_stats("cumulative").print_stats(20)
+        get_logger().info("frame profile written to %s\n%s", self.profile_path, stream.getvalue())
+        self.__profile = None
+        self.__profile_frames = 0
+
+    def handle_events(self, events) -> bool:
+        """
+        Toggles the overlay on F3 and starts profiling on F4. Returns True if the overlay was hidden, so whatever was
+        under it needs drawing again.
+        """
+        hidden = False
+        for event in events:
+            if event.type != pygame.KEYDOWN:
+                continue
+            if event.key == OVERLAY_KEY:
+                self.overlay = not self.overlay
+                hidden = not self.overlay
+                self.__overlay_rect = None
+                self.__overlay_time = 0.0
+            elif event.key == PROFILE_KEY:
+                self.profile()
+        return hidden
+
+    def get_summary(self) -> tuple[float, dict[str, float], dict[str, float]]:
+        """
+        The frame rate and the average seconds in each phase and things drawn per frame, over the last HISTORY frames.
+        """
+        history = list(self.__history)
+        if not history:
+            return 0.0, dict(), dict()
+        total = sum(stats.total for stats in history)
+        phases = dict()
+        counts = dict()
+        for stats in history:
+            for phase, seconds in stats.phases.items():
+                phases[phase] = phases.get(phase, 0.0) + seconds / len(history)
+            for name, amount in stats.counts.items():
+                counts[name] = counts.get(name, 0) + amount / len(history)
+        return len(history) / total if total > 0 else 0.0, phases, counts
+
+    def draw_overlay(self, surface) -> pygame.Rect:
+        """
+        Draws the overlay in the top left corner of surface and returns the part of it that was drawn on.
+        """
+        now = time.perf_counter()
+        if not self.__overlay_lines or now - self.__overlay_time >= OVERLAY_REFRESH:
+            self.__overlay_time = now
+            fps, phases, counts = self.get_summary()
+            frame = 1000 / fps if fps else 0.0
+            lines = [f"{fps:5.1f} fps  {frame:5.1f} ms"]
+            lines += [f"{phase:>14} {phases[phase] * 1000:6.2f} ms" for phase in PHASES if phase in phases]
+            lines.append("  ".join(f"{name} {amount:.0f}" for name, amount in counts.items()))
+            if self.is_profiling():
+                lines.append(f"profiling, {self.__profile_frames} frames to go")
+            # the numbers change every time, so they are not worth keeping in the text cache
+            font = get_font(14)
+            self.__overlay_lines = [font.render(line, True, OVERLAY_COLOUR) for line in lines]
+
+        width = max(line.get_width() for line in self.__overlay_lines) + 8
+        height = sum(line.get_height() for line in self.__overlay_lines) + 8
+        rect = pygame.Rect(0, 0, width, height)
+        # never shrinks, so it always covers the last one
+        if self.__overlay_rect is not None:
+            rect.union_ip(self.__overlay_rect)
+        self.__overlay_rect = rect
+
+        surface.fill(OVERLAY_BACKGROUND, rect)
+        y = 4
+        for line in self.__overlay_lines:
+            surface.blit(line, (4, y))
+            y += line.get_height()
+        return rect
+
+def add_arguments(parser):
+    parser.add_argument("--overlay", action="store_true", help="show frame times on screen (F3 toggles it)")
+    parser.add_argument("--profile-frames", type=int, default=0,
+                        help=f"run the first N frames under cProfile (F4 profiles the next {PROFILE_FRAMES} at any time)")
+    parser.add_argument("--profile-path", default=PROFILE_PATH, help="file to write cProfile stats to")
+
+def apply_arguments(profiler, args):
+    profiler.overlay = args.overlay
+    profiler.profile_path = args.profile_path
+    if args.profile_frames > 0:
+        profiler.profile(args.profile_frames)
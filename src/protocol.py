@@ -0,0 +1,353 @@
+import itertools
+import json
+import struct
+import time as clock
+from datetime import datetime
+
+"""
+Packets are "time\nheader\ndata". The original protocol sends them bare and assumes every recv is exactly one packet,
+which falls apart once a packet is bigger than the recv buffer or two packets arrive together. Newer clients instead
+send every packet as a frame:
+    4 byte big-endian length | 1 byte kind | body
+The length counts the kind byte and the body. Frames always start with a zero byte (they are limited to 16MB) while a
+bare packet starts with the time, so the server can tell the two apart from the first byte a client sends.
+
+A framed client says which protocols it understands in its HANDSHAKE and the server answers with the one it picked:
+    PROTOCOL_TEXT   - bare packets, JSON game state (old clients)
+    PROTOCOL_FRAMED - framed packets, JSON game state
+    PROTOCOL_BINARY - framed packets, game state packed as int16 coordinates
+Every turn is encoded once and the same bytes are sent to every client (see TurnBroadcast). Binary states and snapshots
+start with the index of the client's own santa in the server's order, so only those two bytes differ between clients.
+Spectators get the same snapshot and deltas as players, under the STATE header, with NO_SANTA as their index.
+Clients tell binary packets from JSON ones by the frame kind, so a board too big for the binary format (see
+fits_binary) is sent to binary clients as framed JSON instead.
+
+A framed client can also ask for deltas. It is then sent the whole board once (a snapshot, with santas in the server's
+order and the index of its own santa), and after that only the santas that moved and the gifts that were picked up,
+numbered by turn. StateMirror applies these and rebuilds the usual game_state dictionary.
+"""
+
+PROTOCOL_TEXT = 1
+PROTOCOL_FRAMED = 2
+PROTOCOL_BINARY = 3
+PROTOCOLS = (PROTOCOL_BINARY, PROTOCOL_FRAMED, PROTOCOL_TEXT)
+
+FRAME_HEADER = struct.Struct(">IB")
+MAX_FRAME_SIZE = 1 << 24
+KIND_TEXT = 0
+KIND_BINARY = 1
+
+STATE_HEADER = struct.Struct(">hhHH")
+YOU = struct.Struct(">H")
+SNAPSHOT_HEADER = struct.Struct(">cIH")
+DELTA_HEADER = struct.Struct(">cIHH")
+MOVED = struct.Struct(">Hhh")
+NO_SANTA = 0xFFFF
+
+class Packet:
+    # the time only shows whole seconds, so it is formatted once a second rather than for every packet
+    __time_cache = (None, "")
+
+    @staticmethod
+    def get_time():
+        second = int(clock.time())
+        if Packet.__time_cache[0] != second:
+            Packet.__time_cache = (second, datetime.fromtimestamp(second).strftime("%A %d %B %Y %H:%M:%S"))
+        return Packet.__time_cache[1]
+
+    def __init__(self, header: str, data: str | bytes, time=None):
+        if time is None:
+            time = Packet.get_time()
+        self.__time = time
+        self.header = header
+        self.data = data
+
+    def __str__(self):
+        data = self.data if isinstance(self.data, str) else f"<{len(self.data)} bytes>"
+        return f"{self.__time}\n{self.header}\n{data}"
+
+    @classmethod
+    def from_bytes(cls, bytes):
+        packet_str = bytes.decode()
+        packet_lines = packet_str.split("\n")
+        if len(packet_lines) != 3:
+            raise ValueError("Bad packet.")
+        return cls(packet_lines[1], packet_lines[2], packet_lines[0])
+
+    @classmethod
+    def from_frame(cls, kind, body):
+        parts = body.split(b"\n", 2)
+        if len(parts) != 3:
+            raise ValueError("Bad packet.")
+        time, header, data = parts
+        if kind == KIND_TEXT:
+            data = data.decode()
+        elif kind != KIND_BINARY:
+            raise ValueError("Bad packet kind.")
+        return cls(header.decode(), data, time.decode())
+
+    def get_bytes(self):
+        return str(self).encode()
+
+    def get_frame(self):
+        if isinstance(self.data, bytes):
+            kind = KIND_BINARY
+            body = f"{self.__time}\n{self.header}\n".encode() + self.data
+        else:
+            kind = KIND_TEXT
+            body = str(self).encode()
+        return FRAME_HEADER.pack(len(body) + 1, kind) + body
+
+class PacketReader:
+    """
+    Turns a stream of bytes into packets. Bytes are added with feed() as they arrive, and every packet that has been
+    completed is returned. If framed is None it is worked out from the first byte received.
+    """
+    def __init__(self, framed=None):
+        self.framed = framed
+        self.__buffer = bytearray()
+
+    def feed(self, data) -> list[Packet]:
+        if not data:
+            return []
+
+        if self.framed is None:
+            self.framed = data[0] == 0
+
+        if not self.framed:
+            return [Packet.from_bytes(data)]
+
+        self.__buffer += data
+        packets = list()
+        offset = 0
+        while len(self.__buffer) - offset >= FRAME_HEADER.size:
+            length, kind = FRAME_HEADER.unpack_from(self.__buffer, offset)
+            if length < 1 or length > MAX_FRAME_SIZE:
+                raise ValueError("Bad frame length.")
+            end = offset + 4 + length
+            if len(self.__buffer) < end:
+                break
+            packets.append(Packet.from_frame(kind, bytes(self.__buffer[offset + FRAME_HEADER.size:end])))
+            offset = end
+        del self.__buffer[:offset]
+        return packets
+
+def choose_protocol(offered) -> int:
+    for protocol in PROTOCOLS:
+        if protocol in offered:
+            return protocol
+    raise ValueError("No protocol in common.")
+
+def encode_packet(packet, protocol) -> bytes:
+    if protocol == PROTOCOL_TEXT:
+        return packet.get_bytes()
+    return packet.get_frame()
+
+def fits_binary(grid_size, num_santas, num_gifts=0) -> bool:
+    """
+    Whether a board can go out in the binary format, which has int16 coordinates and uint16 counts and santa indices.
+    """
+    return max(grid_size) <= 0x7FFF and num_santas < NO_SANTA and num_gifts <= 0xFFFF
+
+def encode_board(grid_size, santas, gifts) -> bytes:
+    coordinates = [c for position in santas for c in position] + [c for position in gifts for c in position]
+    return STATE_HEADER.pack(*grid_size, len(santas), len(gifts)) + struct.pack(f">{len(coordinates)}h", *coordinates)
+
+def decode_board(data, offset=0) -> tuple[tuple[int, int], list, list]:
+    width, height, num_santas, num_gifts = STATE_HEADER.unpack_from(data, offset)
+    coordinates = struct.unpack_from(f">{2 * (num_santas + num_gifts)}h", data, offset + STATE_HEADER.size)
+    positions = list(zip(coordinates[0::2], coordinates[1::2]))
+    return (width, height), positions[:num_santas], positions[num_santas:]
+
+def decode_delta(data, offset=0) -> tuple[int, list, list]:
+    _, turn, num_moved, num_removed = DELTA_HEADER.unpack_from(data, offset)
+    offset += DELTA_HEADER.size
+    moved = [MOVED.unpack_from(data, offset + i * MOVED.size) for i in range(num_moved)]
+    offset += num_moved * MOVED.size
+    coordinates = struct.unpack_from(f">{2 * num_removed}h", data, offset)
+    return turn, moved, list(zip(coordinates[0::2], coordinates[1::2]))
+
+def put_first(santas, you) -> list:
+    if not 0 <= you < len(santas):
+        return list(santas)
+    return [santas[you]] + santas[:you] + santas[you + 1:]
+
+def encode_state(game_state, protocol) -> str | bytes:
+    if protocol == PROTOCOL_BINARY:
+        return YOU.pack(0) + encode_board(game_state["grid_size"], game_state["santas"], game_state["gifts"])
+    return json.dumps(game_state)
+
+def decode_state(data) -> dict:
+    if isinstance(data, str):
+        return json.loads(data)
+
+    you, = YOU.unpack_from(data)
+    grid_size, santas, gifts = decode_board(data, YOU.size)
+    return {
+        "grid_size": grid_size,
+        "santas": put_first(santas, you),
+        "gifts": gifts
+    }
+
+def encode_snapshot(turn, you, game_state, protocol) -> str | bytes:
+    if protocol == PROTOCOL_BINARY:
+        return SNAPSHOT_HEADER.pack(b"S", turn, you) + \
+            encode_board(game_state["grid_size"], game_state["santas"], game_state["gifts"])
+    return json.dumps({"type": "snapshot", "turn": turn, "you": you, **game_state})
+
+def encode_delta(turn, moved, removed, protocol) -> str | bytes:
+    if protocol == PROTOCOL_BINARY:
+        coordinates = [c for position in removed for c in position]
+        return DELTA_HEADER.pack(b"D", turn, len(moved), len(removed)) + \
+            b"".join(MOVED.pack(*santa) for santa in moved) + \
+            struct.pack(f">{len(coordinates)}h", *coordinates)
+    return json.dumps({"type": "delta", "turn": turn, "moved": moved, "removed": removed})
+
+class StateMirror:
+    """
+    Keeps a copy of the board up to date from snapshots and deltas.
+    """
+    def __init__(self):
+        self.turn = None
+        self.__grid_size = None
+        self.__you = 0
+        self.__santas = list()
+        self.__gifts = dict()
+
+    def load_snapshot(self, turn, grid_size, you, santas, gifts):
+        self.turn = turn
+        self.__grid_size = tuple(grid_size)
+        self.__you = you
+        self.__santas = [tuple(position) for position in santas]
+        self.__gifts = dict.fromkeys(tuple(position) for position in gifts)
+
+    def apply_delta(self, turn, moved, removed):
+        if self.turn is None or turn != self.turn + 1:
+            raise ValueError(f"Delta for turn {turn} does not follow turn {self.turn}.")
+        self.turn = turn
+        for index, x, y in moved:
+            self.__santas[index] = (x, y)
+        for position in removed:
+            self.__gifts.pop(tuple(position), None)
+
+    def apply(self, data) -> dict:
+        if isinstance(data, str):
+            update = json.loads(data)
+            if update["type"] == "snapshot":
+                self.load_snapshot(update["turn"], update["grid_size"], update["you"], update["santas"], update["gifts"])
+            else:
+                self.apply_delta(update["turn"], update["moved"], update["removed"])
+        elif data[:1] == b"S":
+            _, turn, you = SNAPSHOT_HEADER.unpack_from(data)
+            grid_size, santas, gifts = decode_board(data, SNAPSHOT_HEADER.size)
+            self.load_snapshot(turn, grid_size, you, santas, gifts)
+        else:
+            self.apply_delta(*decode_delta(data))
+
+        return self.get_game_state()
+
+    def get_game_state(self) -> dict:
+        return {
+            "grid_size": self.__grid_size,
+            "santas": put_first(self.__santas, self.__you),
+            "gifts": list(self.__gifts)
+        }
+
+class TurnBroadcast:
+    """
+    Everything sent out for one turn. Each encoding is made the first time a client needs it and then reused for every
+    other client, so sending a turn to more players or spectators only costs the sends themselves. The pieces are
+    returned as lists of buffers to be queued and sent with send_queued, so the shared bytes are never copied per
+    client.
+
+    Old JSON clients are the exception: their santa has to come first in the list, so only the santa and gift strings
+    are shared and the list is put together for each of them.
+    """
+    def __init__(self, turn, grid_size, santas, moved, removed, get_gifts):
+        self.turn = turn
+        self.__grid_size = tuple(grid_size)
+        self.__santas = santas
+        self.__moved = moved
+        self.__removed = removed
+        self.__get_gifts = get_gifts
+        self.__time = Packet.get_time()
+        self.__cache = dict()
+
+    def __cached(self, key, make):
+        if key not in self.__cache:
+            self.__cache[key] = make()
+        return self.__cache[key]
+
+    def __gifts(self):
+        return self.__cached("gifts", self.__get_gifts)
+
+    def __board(self) -> bytes:
+        return self.__cached("board", lambda: encode_board(self.__grid_size, self.__santas, self.__gifts()))
+
+    def __board_json(self) -> bytes:
+        # everything after the opening brace, so per-client fields can go in front
+        return self.__cached("board_json", lambda: json.dumps({
+            "grid_size": self.__grid_size,
+            "santas": self.__santas,
+            "gifts": self.__gifts()
+        })[1:].encode())
+
+    def __fallback(self, protocol, num_gifts=0) -> int:
+        if protocol == PROTOCOL_BINARY and not fits_binary(self.__grid_size, len(self.__santas), num_gifts):
+            return PROTOCOL_FRAMED
+        return protocol
+
+    def get_board(self) -> bytes:
+        """
+        The board from encode_board, with the santas in engine order.
+        """
+        return self.__board()
+
+    def get_state(self, protocol, you) -> tuple[int, list[bytes]]:
+        if self.__fallback(protocol, len(self.__gifts())) == PROTOCOL_BINARY:
+            return KIND_BINARY, [YOU.pack(you), self.__board()]
+
+        santas = self.__cached("santas_json", lambda: [json.dumps(position) for position in self.__santas])
+        tail = self.__cached("gifts_json", lambda: ("], \"gifts\": " + json.dumps(self.__gifts()) + "}").encode())
+        head = self.__cached("grid_json", lambda: f'{{"grid_size": {json.dumps(self.__grid_size)}, "santas": [')
+        return KIND_TEXT, [(head + ", ".join(put_first(santas, you))).encode(), tail]
+
+    def get_snapshot(self, protocol, you) -> tuple[int, list[bytes]]:
+        if self.__fallback(protocol, len(self.__gifts())) == PROTOCOL_BINARY:
+            return KIND_BINARY, [SNAPSHOT_HEADER.pack(b"S", self.turn, you), self.__board()]
+        return KIND_TEXT, [f'{{"type": "snapshot", "turn": {self.turn}, "you": {you}, '.encode(), self.__board_json()]
+
+    def get_delta(self, protocol) -> tuple[int, list[bytes]]:
+        protocol = self.__fallback(protocol)
+        def make():
+            data = encode_delta(self.turn, self.__moved, self.__removed, protocol)
+            return data if isinstance(data, bytes) else data.encode()
+        return (KIND_BINARY if protocol == PROTOCOL_BINARY else KIND_TEXT), [self.__cached(("delta", protocol), make)]
+
+    def get_packet(self, header, protocol, kind, parts) -> list[bytes]:
+        prefix = self.__cached(("prefix", header), lambda: f"{self.__time}\n{header}\n".encode())
+        if protocol == PROTOCOL_TEXT:
+            return [prefix, *parts]
+        length = 1 + len(prefix) + sum(len(part) for part in parts)
+        return [FRAME_HEADER.pack(length, kind) + prefix, *parts]
+
+def send_queued(sock, queue):
+    """
+    Sends buffers from the front of queue (a deque of memoryviews) until it is empty or the socket would block, taking
+    off what went out. Where the platform allows it several buffers go in one call, without joining them first.
+    """
+    while queue:
+        try:
+            if hasattr(sock, "sendmsg"):
+                # IOV_MAX is at least 16 everywhere
+                sent = sock.sendmsg(list(itertools.islice(queue, 16)))
+            else:
+                sent = sock.send(queue[0])
+        except BlockingIOError:
+            return
+        while sent:
+            if sent >= len(queue[0]):
+                sent -= len(queue.popleft())
+            else:
+                queue[0] = queue[0][sent:]
+                sent = 0
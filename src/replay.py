@@ -0,0 +1,189 @@
+import mmap
+import os
+import struct
+import time
+
+from engine import Engine, Direction
+
+"""
+Replays store just enough to play a match again with the Engine: the starting board, the santas in the order they
+joined, and the directions every santa moved in each turn. A file looks like:
+    MAGIC | version | header | santa roster | starting gifts | block | block | ...
+and every block is a keyframe followed by KEYFRAME_INTERVAL turns. Turns are half a byte per santa and keyframes hold
+each santa's position and score plus one bit per starting gift, so everything has a fixed size and any turn can be
+found with a little arithmetic. Seeking loads the keyframe before the turn and plays forward from there.
+
+A turn here is the directions applied after that turn's collect_gifts, and the state "at" a turn is the board just
+after its gifts were collected, which is also what a keyframe holds.
+"""
+
+MAGIC = b"BSRP"
+VERSION = 2
+PREFIX = struct.Struct(">4sB")
+# version -> header, roster entry, position and keyframe santa; version 1 could only hold boards, counts and scores that
+# fit in 16 bits
+FORMATS = {
+    1: (struct.Struct(">hhHHH"), struct.Struct(">hhB"), struct.Struct(">hh"), struct.Struct(">hhH")),
+    2: (struct.Struct(">iiIII"), struct.Struct(">iiB"), struct.Struct(">ii"), struct.Struct(">iiI")),
+}
+HEADER, ROSTER_ENTRY, POSITION, KEYFRAME_SANTA = FORMATS[VERSION]
+KEYFRAME_INTERVAL = 64
+REPLAY_DIR = "../replays"
+
+# 0 is a santa that did not move
+DIRECTIONS = [None] + list(Direction)
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+def make_replay_path(directory=REPLAY_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + ".bsr")
+
+class ReplayWriter:
+    """
+    Records a match as it is played. Create it once every santa has been added to the engine, then call record() with
+    the directions of every turn.
+    """
+    def __init__(self, path, engine, keyframe_interval=KEYFRAME_INTERVAL):
+        self.__engine = engine
+        self.__keys = {key: i for i, key in enumerate(engine.get_santas())}
+        self.__gifts = {gift: i for i, gift in enumerate(engine.get_gifts())}
+        self.__keyframe_interval = keyframe_interval
+        self.__turn = 0
+        self.__file = open(path, "wb")
+
+        santas = engine.get_santas().values()
+        self.__file.write(PREFIX.pack(MAGIC, VERSION))
+        self.__file.write(HEADER.pack(engine.grid_width, engine.grid_height, len(santas), len(self.__gifts),
+                                      keyframe_interval))
+        for santa in santas:
+            name = santa.name.encode()[:255]
+            self.__file.write(ROSTER_ENTRY.pack(santa.x, santa.y, len(name)) + name)
+        for gift in self.__gifts:
+            self.__file.write(POSITION.pack(*gift))
+
+    def __write_keyframe(self):
+        for santa in self.__engine.get_santas().values():
+            self.__file.write(KEYFRAME_SANTA.pack(santa.x, santa.y, santa.score))
+        bitmap = bytearray((len(self.__gifts) + 7) // 8)
+        for gift in self.__engine.get_gifts():
+            i = self.__gifts[gift]
+            bitmap[i // 8] |= 0x80 >> (i % 8)
+        self.__file.write(bitmap)
+
+    def record(self, directions):
+        if self.__file is None:
+            return
+        if self.__turn % self.__keyframe_interval == 0:
+            self.__write_keyframe()
+
+        codes = [0] * (len(self.__keys) + len(self.__keys) % 2)
+        for key, direction in directions:
+            if key in self.__keys:
+                codes[self.__keys[key]] = DIRECTION_CODES.get(direction, 0)
+        self.__file.write(bytes(codes[i] << 4 | codes[i + 1] for i in range(0, len(codes), 2)))
+        self.__turn += 1
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+class ReplayReader:
+    """
+    Opens a replay with mmap, so only the parts that are looked at are ever read from disk.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.__data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = PREFIX.unpack_from(self.__data)
+        if magic != MAGIC or version not in FORMATS:
+            raise ValueError(f"{path} is not a replay this version can read.")
+        header, roster_entry, position, self.__keyframe_santa = FORMATS[version]
+        self.grid_width, self.grid_height, num_santas, num_gifts, self.__keyframe_interval = \
+            header.unpack_from(self.__data, PREFIX.size)
+
+        offset = PREFIX.size + header.size
+        self.names = list()
+        self.__start = list()
+        for _ in range(num_santas):
+            x, y, length = roster_entry.unpack_from(self.__data, offset)
+            offset += roster_entry.size
+            self.names.append(self.__data[offset:offset + length].decode(errors="replace"))
+            self.__start.append((x, y, 0))
+            offset += length
+        self.gifts = [position.unpack_from(self.__data, offset + i * position.size) for i in range(num_gifts)]
+        offset += num_gifts * position.size
+
+        self.__body = offset
+        self.__turn_size = (num_santas + 1) // 2
+        self.__keyframe_size = num_santas * self.__keyframe_santa.size + (num_gifts + 7) // 8
+        self.__block_size = self.__keyframe_size + self.__keyframe_interval * self.__turn_size
+
+        # a match that was cut short can end part way through a block
+        blocks, rest = divmod(len(self.__data) - self.__body, self.__block_size)
+        self.num_turns = blocks * self.__keyframe_interval
+        self.__num_keyframes = blocks
+        if rest >= self.__keyframe_size:
+            self.num_turns += (rest - self.__keyframe_size) // self.__turn_size
+            self.__num_keyframes += 1
+
+    def close(self):
+        self.__data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_keys(self) -> list[str]:
+        return [str(i) for i in range(len(self.names))]
+
+    def get_directions(self, turn) -> list[tuple[str, Direction]]:
+        block, index = divmod(turn, self.__keyframe_interval)
+        offset = self.__body + block * self.__block_size + self.__keyframe_size + index * self.__turn_size
+        directions = list()
+        for i, byte in enumerate(self.__data[offset:offset + self.__turn_size]):
+            for j, code in ((2 * i, byte >> 4), (2 * i + 1, byte & 0x0F)):
+                if code and j < len(self.names):
+                    directions.append((str(j), DIRECTIONS[code]))
+        return directions
+
+    def __load_keyframe(self, engine, block):
+        offset = self.__body + block * self.__block_size
+        keyframe_santa = self.__keyframe_santa
+        santas = [
+            keyframe_santa.unpack_from(self.__data, offset + i * keyframe_santa.size) for i in range(len(self.names))
+        ]
+        offset += len(self.names) * keyframe_santa.size
+        gifts = [
+            gift for i, gift in enumerate(self.gifts) if self.__data[offset + i // 8] & (0x80 >> (i % 8))
+        ]
+        engine.set_state(santas, gifts)
+
+    def new_engine(self) -> Engine:
+        """
+        An engine with the santas from the replay, at the start of the match.
+        """
+        engine = Engine(self.grid_width, self.grid_height, 0)
+        for key, name in zip(self.get_keys(), self.names):
+            engine.add_santa(key, name)
+        engine.set_state(self.__start, self.gifts)
+        return engine
+
+    def seek(self, engine, turn) -> int:
+        """
+        Puts engine into the state at turn, and returns the turn it ended up at.
+        """
+        turn = max(0, min(turn, self.num_turns))
+        if self.__num_keyframes == 0:
+            engine.set_state(self.__start, self.gifts)
+            return 0
+
+        block = min(turn // self.__keyframe_interval, self.__num_keyframes - 1)
+        self.__load_keyframe(engine, block)
+        for past_turn in range(block * self.__keyframe_interval, turn):
+            engine.apply_directions(self.get_directions(past_turn))
+            engine.collect_gifts()
+        return turn
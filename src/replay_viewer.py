@@ -0,0 +1,132 @@
+import argparse
+import time
+
+import pygame
+
+from common import Game, GameMode, Direction, SantaID
+from engine import Engine
+from profiler import add_arguments, apply_arguments
+from replay import ReplayReader
+
+"""
+Plays back a replay recorded by singleplayer.py or server.py:
+    python replay_viewer.py ../replays/20241224-180000.bsr --speed 4
+    SPACE         pause
+    LEFT / RIGHT  back / forward SEEK_STEP turns (PAGE UP / PAGE DOWN for ten times as many)
+    UP / DOWN     twice / half as fast
+    HOME / END    first / last turn
+"""
+
+SPEED = 1.0
+SEEK_STEP = 10
+# how far playback is allowed to fall behind before turns are dropped, so a slow frame does not cause a burst
+MAX_TURNS_PER_UPDATE = 1000
+
+class ReplayGame(Game):
+    def __init__(self, path, speed=SPEED):
+        self.__reader = ReplayReader(path)
+        engine = Engine(self.__reader.grid_width, self.__reader.grid_height, 0)
+        engine.set_state([], self.__reader.gifts)
+        super().__init__(turn_time=0, turn_deadline=0, fast_tick=False, engine=engine)
+
+        self.__santa_ids = [SantaID(key, name) for key, name in zip(self.__reader.get_keys(), self.__reader.names)]
+        self.__speed = speed
+        self.__paused = False
+        self.__owed = 0.0
+        self.__last_update = time.monotonic()
+        self.__turn = 0
+        self.start_game()
+        self.seek(0)
+
+    def get_santa_ids(self) -> list[SantaID]:
+        return self.__santa_ids
+
+    def request_santas(self) -> None:
+        pass
+
+    def received_santas(self) -> bool:
+        return True
+
+    def get_santas(self) -> list[tuple[str, Direction]]:
+        if self.__turn >= self.__reader.num_turns:
+            self.__paused = True
+            return []
+        directions = self.__reader.get_directions(self.__turn)
+        self.__turn += 1
+        self.__update_caption()
+        return directions
+
+    def start_server(self):
+        pass
+
+    def lock_server(self):
+        pass
+
+    def stop_server(self):
+        pass
+
+    def get_server_ip(self) -> str:
+        return "REPLAY"
+
+    def __update_caption(self):
+        state = "paused" if self.__paused else f"x{self.__speed:g}"
+        pygame.display.set_caption(f"Replay - turn {self.__turn}/{self.__reader.num_turns} ({state})")
+
+    def seek(self, turn):
+        self.__turn = self.__reader.seek(self.get_engine(), turn)
+        self.__owed = 0.0
+        self.refresh_board()
+        self.__update_caption()
+
+    def __handle_key(self, key):
+        if key == pygame.K_SPACE:
+            self.__paused = not self.__paused
+        elif key == pygame.K_LEFT:
+            self.seek(self.__turn - SEEK_STEP)
+        elif key == pygame.K_RIGHT:
+            self.seek(self.__turn + SEEK_STEP)
+        elif key == pygame.K_PAGEUP:
+            self.seek(self.__turn - 10 * SEEK_STEP)
+        elif key == pygame.K_PAGEDOWN:
+            self.seek(self.__turn + 10 * SEEK_STEP)
+        elif key == pygame.K_HOME:
+            self.seek(0)
+        elif key == pygame.K_END:
+            self.seek(self.__reader.num_turns)
+        elif key == pygame.K_UP:
+            self.__speed *= 2
+        elif key == pygame.K_DOWN:
+            self.__speed /= 2
+        self.__update_caption()
+
+    def update(self, events):
+        now = time.monotonic()
+        elapsed = now - self.__last_update
+        self.__last_update = now
+
+        for event in events:
+            if event.type == pygame.KEYDOWN:
+                self.__handle_key(event.key)
+
+        if self.__paused:
+            return
+        # with no turn time every update applies one turn and starts the next, so playback speed is just how many
+        # updates are made
+        self.__owed = min(self.__owed + elapsed * self.__speed, MAX_TURNS_PER_UPDATE)
+        while self.__owed >= 1 and self.get_game_mode() == GameMode.PLAYING and not self.__paused:
+            super().update([])
+            self.__owed -= 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a recorded match.")
+    parser.add_argument("replay", help="replay file to open")
+    parser.add_argument("--speed", type=float, default=SPEED, help="turns per second")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    game = ReplayGame(args.replay, args.speed)
+    apply_arguments(game.get_profiler(), args)
+    game.run()
+
+if __name__ == "__main__":
+    main()
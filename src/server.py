@@ -1,44 +1,166 @@
+import argparse
 import json
+import selectors
+import time
+from collections import deque
 
-from common import Game, Direction, SantaID, GRID_WIDTH, GRID_HEIGHT
-from threading import Thread, Event
+from common import Game, Direction, SantaID, TURN_TIME, TURN_DEADLINE, FAST_TICK
+from threading import Thread, Event, Lock
 import socket
-from multiplayer import Packet
+from logger import get_logger, configure, LEVELS, INCOMING, OUTGOING
+from metrics import ConnectionMetrics, MatchMetrics
+from profiler import add_arguments, apply_arguments
+from protocol import Packet, PacketReader, TurnBroadcast, PROTOCOL_TEXT, PROTOCOL_FRAMED, PROTOCOL_BINARY, NO_SANTA, \
+    MAX_FRAME_SIZE, choose_protocol, encode_packet, fits_binary, send_queued
+from replay import make_replay_path
+from shared_turns import SharedTurns
+
+# the most that can wait to be sent to a client before it is dropped for not reading: enough for any one frame
+MAX_QUEUED = MAX_FRAME_SIZE
+# how long stopping waits for clients to take their STOP
+STOP_TIMEOUT = 1.0
 
 class Connection:
-    def __init__(self, connection, address, running):
+    """
+    One client. The socket is non-blocking: sends go out as far as the socket takes them and the rest is queued, and
+    on_pending(connection) is called when something is left waiting, so whoever owns the selector can watch for
+    EVENT_WRITE and call flush(). A client that gets more than MAX_QUEUED behind is marked overflowed and sent
+    nothing more; its owner should close it.
+    """
+    def __init__(self, connection, address, turn_deadline, metrics=None):
+        connection.setblocking(False)
         self.__connection = connection
         self.__address = address
-        self.__running_event = running
+        # the client id: the key for this connection everywhere in the server and for its santa in the engine
+        self.__client_id = f"{address[0]}:{address[1]}"
+        self.__turn_deadline = turn_deadline
         self.__name = ""
         self.__direction = None
-        self.__thread = Thread(target=self.__thread_target)
-        self.__thread.start()
+        self.__reader = PacketReader()
+        self.__protocol = PROTOCOL_TEXT
+        self.delta = False
+        self.spectator = False
+        self.handshaken = False
+        self.room = None
+        self.synced_turn = None
+        # offered in the handshake to take turns through shared memory
+        self.shared_memory = False
+        # attached to the shared memory, so its turns go through there
+        self.local = False
+        self.metrics = metrics or ConnectionMetrics()
         self.active = True
+        self.__outbox = deque()
+        self.__queued = 0
+        # the game thread sends turns while the network thread flushes
+        self.__send_lock = Lock()
+        self.on_pending = None
+        self.overflowed = False
 
-    def __thread_target(self):
-        while self.__running_event.is_set():
+    def fileno(self):
+        return self.__connection.fileno()
+
+    def on_readable(self):
+        try:
             try:
-                data = self.__connection.recv(1024)
-                if not data:
-                    raise Exception("Socket Closed")
-                packet = Packet.from_bytes(data)
-                print("INCOMING:\n" + str(packet))
+                data = self.__connection.recv(65536)
+            except BlockingIOError:
+                return
+            if not data:
+                raise Exception("Socket Closed")
+            self.metrics.bytes_in += len(data)
+            log = get_logger()
+            log.event(INCOMING, self.get_address(), [data])
+            for packet in self.__reader.feed(data):
+                log.debug("INCOMING %s\n%s", self.get_address(), packet, category="traffic")
                 if packet.header == "DIRECTION":
                     self.__direction = getattr(Direction, packet.data)
+                    self.metrics.direction_received()
                 elif packet.header == "HANDSHAKE":
-                    self.__name = packet.data
-            except Exception as e:
-                print(f"Exception: {e}")
-                packet = Packet("EXCEPTION", f"An error occurred. Your connection has been terminated. error={type(e)}")
-                try:
-                    self.__connection.send(packet.get_bytes())
-                    self.__connection.shutdown(socket.SHUT_RDWR)
-                    self.__connection.close()
-                except OSError:
-                    pass
-                self.active = False
-                break
+                    self.__handshake(packet.data)
+                elif packet.header == "SHARED MEMORY":
+                    self.local = True
+                    # WAKE is all that goes out on a turn, so it must not wait for an ACK
+                    self.__connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception as e:
+            get_logger().warning("%s: %r", self.get_address(), e)
+            self.close(Packet("EXCEPTION", f"An error occurred. Your connection has been terminated. error={type(e)}"))
+
+    def __handshake(self, data):
+        if not self.__reader.framed:
+            self.__name = data
+            self.handshaken = True
+            return
+
+        handshake = json.loads(data)
+        self.__name = handshake.get("name", "")
+        offered = [protocol for protocol in handshake.get("protocols", []) if protocol != PROTOCOL_TEXT]
+        self.__protocol = choose_protocol(offered or [PROTOCOL_FRAMED])
+        # spectators follow the board through snapshots and deltas, so they always get them
+        self.spectator = bool(handshake.get("spectator", False))
+        self.delta = self.spectator or bool(handshake.get("delta", False))
+        self.room = handshake.get("room")
+        self.shared_memory = not self.spectator and bool(handshake.get("shared_memory", False))
+        self.handshaken = True
+        self.send_packet(Packet("HANDSHAKE", json.dumps({
+            "protocol": self.__protocol,
+            "delta": self.delta,
+            "spectator": self.spectator,
+            "deadline": self.__turn_deadline
+        })))
+
+    def close(self, packet=None):
+        """
+        Closes the connection after one last try at sending what is queued and packet, without waiting for the client.
+        """
+        with self.__send_lock:
+            try:
+                if packet is not None and not self.overflowed:
+                    self.__outbox.append(memoryview(encode_packet(packet, self.__protocol)))
+                send_queued(self.__connection, self.__outbox)
+                self.__connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.__outbox.clear()
+            self.__queued = 0
+        self.__connection.close()
+        self.active = False
+
+    def get_handoff(self) -> dict:
+        """
+        What another process needs to carry on talking to this client, see from_handoff.
+        """
+        with self.__send_lock:
+            unsent = b"".join(self.__outbox)
+        return {
+            "name": self.__name,
+            "protocol": self.__protocol,
+            "framed": self.__reader.framed,
+            "delta": self.delta,
+            "spectator": self.spectator,
+            "unsent": unsent
+        }
+
+    @classmethod
+    def from_handoff(cls, connection, address, turn_deadline, handoff, metrics=None):
+        self = cls(connection, address, turn_deadline, metrics)
+        self.__name = handoff["name"]
+        self.__protocol = handoff["protocol"]
+        self.__reader = PacketReader(handoff["framed"])
+        self.delta = handoff["delta"]
+        self.spectator = handoff["spectator"]
+        self.handshaken = True
+        if handoff["unsent"]:
+            self.__outbox.append(memoryview(handoff["unsent"]))
+            self.__queued = len(handoff["unsent"])
+        return self
+
+    def detach(self):
+        # gives up the socket without shutting it down, for when it has been handed to another process
+        self.active = False
+        return self.__connection
+
+    def is_player(self):
+        return self.handshaken and not self.spectator
 
     def get_name(self):
         return self.__name
@@ -49,130 +171,501 @@ class Connection:
         return direction
 
     def get_address(self):
-        return f"{self.__address[0]}:{self.__address[1]}"
+        return self.__client_id
 
-    def send_packet(self, packet):
+    def get_address_tuple(self):
+        return self.__address
+
+    def get_protocol(self):
+        return self.__protocol
+
+    def has_output(self) -> bool:
+        return bool(self.__outbox)
+
+    def flush(self):
+        """
+        Sends what is queued, as far as the socket takes it without blocking.
+        """
+        with self.__send_lock:
+            self.__flush()
+
+    def __flush(self):
+        # called with the send lock held
         try:
-            self.__connection.send(packet.get_bytes())
-            print("OUTGOING:\n" + str(packet))
+            send_queued(self.__connection, self.__outbox)
         except OSError:
-            pass
+            # the client has gone; reading will find out and close the connection
+            self.__outbox.clear()
+        self.__queued = sum(len(part) for part in self.__outbox) if self.__outbox else 0
 
-class Server(Game):
+    def __send(self, parts):
+        with self.__send_lock:
+            if self.overflowed or not self.active:
+                return
+            waiting = bool(self.__outbox)
+            self.__outbox.extend(memoryview(part) for part in parts if part)
+            self.__queued += sum(len(part) for part in parts)
+            if not waiting:
+                # nothing was waiting, so this can go straight out
+                self.__flush()
+            if self.__queued > MAX_QUEUED:
+                get_logger().warning("%s: dropped, %d bytes behind", self.get_address(), self.__queued)
+                self.__outbox.clear()
+                self.__queued = 0
+                self.overflowed = True
+            pending = self.overflowed or (self.__outbox and not waiting)
+        if pending and self.on_pending is not None:
+            self.on_pending(self)
+
+    def send_packet(self, packet):
+        data = encode_packet(packet, self.__protocol)
+        self.metrics.bytes_out += len(data)
+        self.__send([data])
+        log = get_logger()
+        log.event(OUTGOING, self.get_address(), [data])
+        log.debug("OUTGOING %s\n%s", self.get_address(), packet, category="traffic")
+
+    def send_turn(self, header, broadcast, parts):
+        self.metrics.bytes_out += sum(len(part) for part in parts)
+        self.__send(parts)
+        log = get_logger()
+        log.event(OUTGOING, self.get_address(), parts)
+        log.debug("OUTGOING %s %s turn %d", self.get_address(), header, broadcast.turn, category="traffic")
+
+SERVER_PORT = 27910
+METRICS_INTERVAL = 10.0
+
+def flush_all(connections, timeout):
+    """
+    Waits up to timeout seconds for what is queued on connections to be sent, for when nothing else is flushing them.
+    """
+    pending = [connection for connection in connections if connection.active and connection.has_output()]
+    if not pending:
+        return
+    give_up = time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+        for connection in pending:
+            selector.register(connection, selectors.EVENT_WRITE)
+        while selector.get_map() and time.monotonic() < give_up:
+            for key, _ in selector.select(give_up - time.monotonic()):
+                key.fileobj.flush()
+                if not key.fileobj.has_output():
+                    selector.unregister(key.fileobj)
+
+def diff_positions(last_positions, positions) -> list[list[int]]:
+    return [
+        [i, *position] for i, position in enumerate(positions)
+        if i >= len(last_positions) or last_positions[i] != position
+    ]
+
+def encode_turn(broadcast, players, spectators, indices) -> list[tuple[Connection, str, list[bytes]]]:
+    """
+    Picks what each connection gets for this turn: a full state, a snapshot or just the delta.
+    """
+    packets = list()
+    for header, group in (("PLEASE SEND ME YOUR DIRECTION", players), ("STATE", spectators)):
+        for connection in group:
+            protocol = connection.get_protocol()
+            you = indices.get(connection.get_address(), NO_SANTA)
+            if not connection.delta:
+                kind, parts = broadcast.get_state(protocol, you)
+            elif connection.synced_turn == broadcast.turn - 1:
+                kind, parts = broadcast.get_delta(protocol)
+            else:
+                kind, parts = broadcast.get_snapshot(protocol, you)
+            connection.synced_turn = broadcast.turn
+            packets.append((connection, header, broadcast.get_packet(header, protocol, kind, parts)))
+    return packets
+
+class ConnectionRegistry:
+    """
+    Every connection the server has, keyed by client id, with the players (in the order they joined) and spectators
+    kept apart so a turn never has to look through everyone. Safe to use from the game and network threads at once.
+    """
     def __init__(self):
-        super().__init__()
+        self.__lock = Lock()
+        self.__connections: dict[str, Connection] = dict()
+        self.__players: dict[str, Connection] = dict()
+        self.__spectators: dict[str, Connection] = dict()
+
+    def __len__(self):
+        return len(self.__connections)
+
+    def add(self, connection):
+        with self.__lock:
+            self.__connections[connection.get_address()] = connection
+
+    def remove(self, client_id) -> Connection | None:
+        with self.__lock:
+            self.__players.pop(client_id, None)
+            self.__spectators.pop(client_id, None)
+            return self.__connections.pop(client_id, None)
+
+    def get(self, client_id) -> Connection | None:
+        return self.__connections.get(client_id)
+
+    def is_filed(self, client_id) -> bool:
+        return client_id in self.__players or client_id in self.__spectators
+
+    def handshaken(self, connection):
+        """
+        Files a connection as a player or spectator once it has said which it is.
+        """
+        with self.__lock:
+            client_id = connection.get_address()
+            if client_id in self.__connections:
+                (self.__spectators if connection.spectator else self.__players)[client_id] = connection
+
+    def get_all(self) -> list[Connection]:
+        with self.__lock:
+            return list(self.__connections.values())
+
+    def get_players(self) -> list[Connection]:
+        with self.__lock:
+            return list(self.__players.values())
+
+    def get_spectators(self) -> list[Connection]:
+        with self.__lock:
+            return list(self.__spectators.values())
+
+class Server(Game):
+    def __init__(self, turn_time=TURN_TIME, turn_deadline=TURN_DEADLINE, fast_tick=FAST_TICK, host=None, port=SERVER_PORT,
+                 metrics_csv=None, metrics_interval=METRICS_INTERVAL, replay_path=None, seed=None, engine=None,
+                 shared_memory=False):
+        super().__init__(turn_time, turn_deadline, fast_tick, engine, replay_path, seed)
         self.__accepting_event = Event()
         self.__running_event = Event()
         self.__await_event = Event()
-        self.__accepter = Thread(target=self.__accept_target, daemon=True)
+        self.__lock = Lock()
+        self.__selector = selectors.DefaultSelector()
+        self.__wakeup_recv, self.__wakeup_send = socket.socketpair()
+        self.__wakeup_send.setblocking(False)
+        # connections with something left to send, for the network thread to watch
+        self.__pending = set()
+        self.__pending_lock = Lock()
         self.__thread = Thread(target=self.__thread_target, daemon=True)
-        self.__connections = list()
+        self.__connections = ConnectionRegistry()
         self.__direction_dict = dict()
-        self.__connection_names = dict()
-        self.__host = socket.gethostbyname(socket.gethostname())
-        self.__port = 27910
+        self.__awaiting = set()
+        self.__turn = 0
+        self.__last_positions = list()
+        self.__host = host or socket.gethostbyname(socket.gethostname())
+        self.__port = port
+        self.__metrics = MatchMetrics()
+        self.__metrics_csv = metrics_csv
+        self.__metrics_interval = metrics_interval
+        self.__barrier_start = None
+        self.__shared_memory = shared_memory
+        self.__shared = None
+        # client id -> slot for players answering through shared memory this turn
+        self.__local_slots = dict()
+
+    def __accept(self, sock):
+        try:
+            conn, addr = sock.accept()
+        except OSError as e:
+            get_logger().error("accept failed: %s", e)
+            return
+
+        metrics = self.__metrics.add_connection(f"{addr[0]}:{addr[1]}")
+        connection = Connection(conn, addr, self.get_turn_deadline(), metrics)
+        connection.on_pending = self.__on_pending
+        self.__connections.add(connection)
+        self.__selector.register(connection, selectors.EVENT_READ)
+
+    def __read(self, connection):
+        connection.on_readable()
+        address = connection.get_address()
+        direction = connection.get_direction()
+        if connection.active and connection.handshaken and not self.__connections.is_filed(address):
+            if connection.is_player() and not self.__accepting_event.is_set():
+                # the game has started; only spectators can still join
+                connection.close(Packet("EXCEPTION", "The game has already started."))
+            else:
+                self.__connections.handshaken(connection)
+
+        with self.__lock:
+            if connection.active:
+                if self.__await_event.is_set() and address in self.__awaiting and direction is not None:
+                    self.__direction_dict[address] = direction
+                # local players send ANSWERED once their direction is in their slot
+                if address in self.__local_slots:
+                    self.__collect_local([address])
+            else:
+                self.__drop(connection)
+            self.__check_barrier()
+
+    def __drop(self, connection):
+        # called with the lock held, once the connection has been closed
+        address = connection.get_address()
+        self.__selector.unregister(connection)
+        self.__connections.remove(address)
+        self.__metrics.remove_connection(address)
+        self.__direction_dict.pop(address, None)
+        self.__awaiting.discard(address)
 
-    def __accept_target(self):
+    def __on_pending(self, connection):
+        # called from whichever thread sent, so the network thread is woken to watch the connection
+        with self.__pending_lock:
+            wake = not self.__pending
+            self.__pending.add(connection)
+        if wake:
+            try:
+                self.__wakeup_send.send(b"\0")
+            except BlockingIOError:
+                # the network thread has wake-ups waiting already
+                pass
+
+    def __watch_pending(self):
+        with self.__pending_lock:
+            pending, self.__pending = self.__pending, set()
+        for connection in pending:
+            if connection.overflowed and connection.active:
+                connection.close()
+                with self.__lock:
+                    self.__drop(connection)
+                    self.__check_barrier()
+            elif connection.active:
+                self.__watch_writes(connection)
+
+    def __watch_writes(self, connection):
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.has_output() else 0)
+        if self.__selector.get_key(connection).events != events:
+            self.__selector.modify(connection, events)
+
+    def __check_barrier(self):
+        if self.__await_event.is_set() and len(self.__direction_dict) >= len(self.__awaiting):
+            self.__await_event.clear()
+            self.__record_barrier()
+
+    def __record_barrier(self):
+        if self.__barrier_start is not None:
+            self.__metrics.barrier_wait.add(time.monotonic() - self.__barrier_start)
+            self.__barrier_start = None
+
+    def __thread_target(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # AF_INET = internet protocol
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind((self.__host, self.__port))
-        sock.listen(64)
-        while self.__running_event.is_set():
-            try:
-                conn, addr = sock.accept()
-                if self.__accepting_event.is_set():
-                    self.__connections.append(Connection(conn, addr, self.__running_event))
-            except Exception as e:
-                print(e)
+        sock.listen(socket.SOMAXCONN)
+        self.__selector.register(sock, selectors.EVENT_READ)
+        self.__selector.register(self.__wakeup_recv, selectors.EVENT_READ)
 
-    def __thread_target(self):
-        self.__direction_dict = dict()
+        timeout = self.__metrics_interval if self.__metrics_csv else None
+        next_dump = time.monotonic() + self.__metrics_interval
         while self.__running_event.is_set():
-            try:
-                stopped_connections = list()
-                for i, connection in enumerate(self.__connections):
-                    direction = connection.get_direction()
-                    address = connection.get_address()
-                    self.__connection_names[address] = connection.get_name()
-                    if self.__await_event.is_set():
-                        if direction is not None:
-                            self.__direction_dict[address] = direction
-                        if len(self.__direction_dict) == len(self.__connections):
-                            self.__await_event.clear()
-                    if not connection.active:
-                        stopped_connections.append(i)
-                for i in stopped_connections:
-                    connection = self.__connections.pop(i)
-                    address = connection.get_address()
-                    self.__connection_names.pop(address, None)
-                    self.__direction_dict.pop(address, None)
-            except Exception as e:
-                print(e)
+            if self.__metrics_csv and time.monotonic() >= next_dump:
+                self.__metrics.write_csv(self.__metrics_csv)
+                next_dump = time.monotonic() + self.__metrics_interval
+
+            for key, events in self.__selector.select(timeout):
+                try:
+                    if key.fileobj is sock:
+                        self.__accept(sock)
+                    elif key.fileobj is self.__wakeup_recv:
+                        self.__wakeup_recv.recv(1024)
+                    else:
+                        connection = key.fileobj
+                        if events & selectors.EVENT_READ:
+                            self.__read(connection)
+                        if connection.active and events & selectors.EVENT_WRITE:
+                            connection.flush()
+                            self.__watch_writes(connection)
+                except Exception as e:
+                    get_logger().error("server loop: %r", e)
+            self.__watch_pending()
+
+        self.__selector.close()
+        sock.close()
+        if self.__metrics_csv:
+            self.__metrics.write_csv(self.__metrics_csv)
 
     def start_server(self):
         self.__running_event.set()
         self.__accepting_event.set()
         self.__await_event.clear()
-        self.__accepter.start()
         self.__thread.start()
 
     def lock_server(self):
         self.__accepting_event.clear()
 
     def stop_server(self):
+        if not self.__running_event.is_set():
+            return
         self.__running_event.clear()
+        self.__wakeup_send.send(b"\0")
+        self.__thread.join()
 
-        for connection in self.__connections:
+        connections = self.__connections.get_all()
+        for connection in connections:
             connection.send_packet(Packet(
                 "STOP",
                 "thanks"
             ))
+        flush_all(connections, STOP_TIMEOUT)
+        for connection in connections:
+            connection.close()
+        if self.__shared is not None:
+            self.__shared.close()
+            self.__shared = None
 
-        self.__thread.join()
-        self.__accepter.join(timeout=0)
+    def get_metrics(self) -> MatchMetrics:
+        return self.__metrics
 
     def get_server_ip(self) -> str:
         return f"{self.__host}:{self.__port}"
 
+    def has_players(self) -> bool:
+        santas = self.get_engine().get_santas()
+        return any(c.get_address() in santas for c in self.__connections.get_players())
+
     def get_santa_ids(self) -> list[SantaID]:
-        santa_ids = list()
-        for address, name in self.__connection_names.items():
-            santa_ids.append(SantaID(address, name))
-        return santa_ids
+        return [SantaID(connection.get_address(), connection.get_name()) for connection in self.__connections.get_players()]
+
+    def __update_turn(self):
+        engine = self.get_engine()
+        positions = [(santa.x, santa.y) for santa in engine.get_santas().values()]
+
+        self.__turn += 1
+        moved = diff_positions(self.__last_positions, positions)
+        removed = [list(gift) for gift in engine.get_collected()]
+        self.__last_positions = positions
+        return moved, removed
 
     def request_santas(self) -> None:
-        gifts = self.get_gifts()
+        engine = self.get_engine()
+        santas = engine.get_santas()
+        indices = {ip: i for i, ip in enumerate(santas)}
+        connections = [c for c in self.__connections.get_players() if c.get_address() in santas]
+        spectators = self.__connections.get_spectators()
+        with self.__lock:
+            self.__awaiting = {c.get_address() for c in connections}
+            self.__direction_dict = dict()
+            self.__barrier_start = None
+            self.__await_event.set()
 
-        self.__await_event.set()
+        encode_start = time.perf_counter()
+        moved, removed = self.__update_turn()
+        broadcast = TurnBroadcast(self.__turn, (engine.grid_width, engine.grid_height), self.__last_positions,
+                                  moved, removed, engine.get_gifts)
+        local, remote = list(), list()
+        for connection in connections:
+            (local if connection.local else remote).append(connection)
+        if self.__shared_memory and self.__shared is None:
+            self.__share_turns(connections, indices, broadcast)
+        packets = encode_turn(broadcast, remote, spectators, indices)
+        with self.__lock:
+            self.__local_slots = {c.get_address(): indices[c.get_address()] for c in local}
 
-        for connection in self.__connections:
-            santas = list()
-            for loop_conn in self.__connections:
-                address = loop_conn.get_address()
-                if connection.get_address() == address:
-                    santas.insert(0, self.get_santa_position(address))
-                else:
-                    santas.append(self.get_santa_position(address))
+        send_start = time.perf_counter()
+        if local:
+            _, (delta,) = broadcast.get_delta(PROTOCOL_BINARY)
+            slots = self.__local_slots.values()
+            # a bot that answered the last turn has that board already, so only needs the delta
+            needs_board = any(not self.__shared.read_answer(slot, self.__turn - 1)[0] for slot in slots)
+            self.__shared.publish(self.__turn, broadcast.get_board() if needs_board else b"", delta, slots)
+            for connection in local:
+                connection.metrics.request_sent()
+                if self.__shared.is_sleeping(indices[connection.get_address()]):
+                    connection.send_packet(Packet("WAKE", ""))
+        for connection, header, parts in packets:
+            if not connection.spectator:
+                connection.metrics.request_sent()
+            connection.send_turn(header, broadcast, parts)
+        send_end = time.perf_counter()
+        self.__metrics.encode.add(send_start - encode_start)
+        self.__metrics.send.add(send_end - send_start)
 
-            connection.send_packet(Packet(
-                "PLEASE SEND ME YOUR DIRECTION",
-                json.dumps({
-                    "grid_size": [GRID_WIDTH, GRID_HEIGHT],
-                    "santas": santas,
-                    "gifts": gifts
-                })
-            ))
+        with self.__lock:
+            if self.__await_event.is_set():
+                self.__barrier_start = time.monotonic()
+                self.__check_barrier()
+            else:
+                # every answer was in before the last request went out
+                self.__metrics.barrier_wait.add(0.0)
+
+    def __share_turns(self, connections, indices, broadcast):
+        """
+        Offers shared memory to the players on this machine. Those that attach get their turns through it from the
+        next turn on; everyone else carries on over the network.
+        """
+        local_hosts = {"::1", self.__host}
+        offered = [c for c in connections if c.shared_memory and
+                   (c.get_address_tuple()[0].startswith("127.") or c.get_address_tuple()[0] in local_hosts)]
+        engine = self.get_engine()
+        # local bots read the binary board, so a board too big for it goes over the network as JSON instead
+        grid_size = (engine.grid_width, engine.grid_height)
+        if not offered or not fits_binary(grid_size, len(indices), len(engine.get_gifts())):
+            self.__shared_memory = False
+            return
+        # boards only get smaller as gifts are collected, so the first one is the biggest
+        self.__shared = SharedTurns(len(indices), len(broadcast.get_board()))
+        for connection in offered:
+            connection.send_packet(Packet("SHARED MEMORY", json.dumps({
+                "name": self.__shared.get_name(),
+                "slot": indices[connection.get_address()]
+            })))
+
+    def __collect_local(self, addresses):
+        # called with the lock held
+        for address in addresses:
+            if address not in self.__awaiting or address in self.__direction_dict:
+                continue
+            answered, direction = self.__shared.read_answer(self.__local_slots[address], self.__turn)
+            if answered:
+                connection = self.__connections.get(address)
+                if connection is not None:
+                    connection.metrics.direction_received()
+                if direction is not None:
+                    self.__direction_dict[address] = direction
 
     def received_santas(self) -> bool:
         return not self.__await_event.is_set()
 
     def get_santas(self) -> list[tuple[str, Direction]]:
-        items = self.__direction_dict.items()
-        self.__direction_dict = dict()
+        # closes the turn, so directions that turn up after the deadline are thrown away
+        with self.__lock:
+            if self.__local_slots and self.__await_event.is_set():
+                self.__collect_local(list(self.__local_slots))
+            self.__local_slots = dict()
+            if self.__await_event.is_set():
+                self.__record_barrier()
+                for address in self.__awaiting.difference(self.__direction_dict):
+                    connection = self.__connections.get(address)
+                    if connection is not None:
+                        connection.metrics.turn_missed()
+            items = list(self.__direction_dict.items())
+            self.__direction_dict = dict()
+            self.__awaiting = set()
+            self.__await_event.clear()
         return items
 
 def main():
-    game = Server()
+    parser = argparse.ArgumentParser(description="Host a multiplayer game.")
+    parser.add_argument("--turn-time", type=float, default=TURN_TIME, help="seconds between turns")
+    parser.add_argument("--deadline", type=float, default=TURN_DEADLINE, help="seconds santas have to answer each turn")
+    parser.add_argument("--fast-tick", action="store_true", help="start the next turn as soon as every santa answers")
+    parser.add_argument("--host", default=None, help="address to listen on (default: this machine's address)")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--metrics-csv", default=None, help="file to append latency and traffic statistics to")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL, help="seconds between statistics")
+    parser.add_argument("--replay", default=None, help="file to record the match to (default: a new file in replays/)")
+    parser.add_argument("--no-replay", action="store_true", help="do not record the match")
+    parser.add_argument("--seed", type=int, default=None, help="seed for where gifts and santas start")
+    parser.add_argument("--log-level", choices=LEVELS, default="info", help="use debug to see every packet")
+    parser.add_argument("--event-log", default=None, help="file to record every packet in and out to")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="send turns to bots on this machine through shared memory instead of the network")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    configure(LEVELS[args.log_level], event_log=args.event_log)
+
+    replay_path = None if args.no_replay else args.replay or make_replay_path()
+    game = Server(args.turn_time, args.deadline, args.fast_tick, args.host, args.port,
+                  args.metrics_csv, args.metrics_interval, replay_path, args.seed,
+                  shared_memory=args.shared_memory)
+    apply_arguments(game.get_profiler(), args)
     game.run()
 
 if __name__ == "__main__":
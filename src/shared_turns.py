@@ -0,0 +1,195 @@
+import os
+import struct
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from engine import Direction
+from protocol import StateMirror, DELTA_HEADER, MOVED, decode_board, decode_delta
+
+"""
+Turns for bots on the same machine as the server, through shared memory instead of the network. The server writes
+each turn's board and delta (see encode_delta) into the shared memory once, however many local bots there are. A bot
+keeps its own StateMirror, so it reads the whole board only for its first turn and after missing one, and just the
+delta otherwise; the server leaves the board out when every local bot answered the turn before, so it has no need to
+encode it either. Each bot writes its direction into its own slot and sends a small ANSWERED packet, which wakes the
+server up to read the slot straight away. The TCP connection stays open for everything else.
+
+Bots wait for the next turn by watching the shared memory for SPIN_TIME, then mark themselves as sleeping and wait on
+their socket; the server sends a WAKE packet to sleeping bots when it writes a turn, so an idle bot costs nothing. On a
+single core watching only takes time from the server, so bots go straight to sleep there.
+
+Layout:
+    header: MAGIC | number of slots (2 bytes) | ring size (1 byte) | board capacity (4 bytes) |
+            delta capacity (4 bytes) | latest turn (4 bytes)
+    slots:  for each player: turn asked (4 bytes) | turn answered (4 bytes) | direction (1 byte) | sleeping (1 byte)
+    ring:   RING_SIZE entries of: turn (4 bytes) | board length (4 bytes) | delta length (4 bytes) |
+            board (board capacity bytes, see encode_board) | delta (delta capacity bytes, binary encode_delta)
+A turn is written into entry turn % RING_SIZE, with the entry's turn set to 0 while it is being written. Bots decode
+straight from the shared memory without copying it first, so a reader that finds a different turn in the entry after
+decoding knows it was overwritten, throws away what it decoded and reads it again. A delta length of 0 means there is
+no delta for that turn, so bots read the board, and a board length of 0 means the board was left out. A bot only takes a
+turn whose number is in its slot's turn asked, so turns it was sent over the network are not seen twice.
+"""
+
+MAGIC = b"BSSM"
+HEADER = struct.Struct(">4sHBII")
+LATEST = struct.Struct(">I")
+ASKED = struct.Struct(">I")
+ANSWERED = struct.Struct(">I")
+SLOT = struct.Struct(">IIBB")
+ENTRY = struct.Struct(">III")
+RING_SIZE = 4
+NO_DIRECTION = 0xFF
+DIRECTIONS = list(Direction)
+SPIN_TIME = 0.002 if (os.cpu_count() or 1) > 1 else 0.0
+# longest a sleeping bot goes without looking, in case a WAKE crossed with it going to sleep on another core
+SLEEP_TIME = 0.05
+
+def get_delta_capacity(num_slots) -> int:
+    # every santa can move and pick up one gift a turn
+    return DELTA_HEADER.size + num_slots * (MOVED.size + 4)
+
+def get_size(num_slots, capacity) -> int:
+    return HEADER.size + LATEST.size + num_slots * SLOT.size + \
+        RING_SIZE * (ENTRY.size + capacity + get_delta_capacity(num_slots))
+
+class SharedTurns:
+    """
+    The server's end: owns the shared memory and removes it when closed.
+    """
+    def __init__(self, num_slots, capacity):
+        self.__num_slots = num_slots
+        self.__capacity = capacity
+        self.__delta_capacity = get_delta_capacity(num_slots)
+        self.__memory = SharedMemory(create=True, size=get_size(num_slots, capacity))
+        self.__slots = HEADER.size + LATEST.size
+        self.__ring = self.__slots + num_slots * SLOT.size
+        HEADER.pack_into(self.__memory.buf, 0, MAGIC, num_slots, RING_SIZE, capacity, self.__delta_capacity)
+        LATEST.pack_into(self.__memory.buf, HEADER.size, 0)
+        for slot in range(num_slots):
+            SLOT.pack_into(self.__memory.buf, self.__slots + slot * SLOT.size, 0, 0, NO_DIRECTION, 0)
+
+    def get_name(self) -> str:
+        return self.__memory.name
+
+    def publish(self, turn, board, delta, slots):
+        """
+        Makes board (from encode_board) and delta (the binary encode_delta from the turn before) the latest turn, for
+        the players in slots.
+        """
+        if len(board) > self.__capacity:
+            raise ValueError(f"Board of {len(board)} bytes does not fit in {self.__capacity}.")
+        if len(delta) > self.__delta_capacity:
+            delta = b""
+        buf = self.__memory.buf
+        entry = self.__ring + (turn % RING_SIZE) * (ENTRY.size + self.__capacity + self.__delta_capacity)
+        start = entry + ENTRY.size
+        ENTRY.pack_into(buf, entry, 0, len(board), len(delta))
+        buf[start:start + len(board)] = board
+        buf[start + self.__capacity:start + self.__capacity + len(delta)] = delta
+        ENTRY.pack_into(buf, entry, turn, len(board), len(delta))
+        for slot in slots:
+            ASKED.pack_into(buf, self.__slots + slot * SLOT.size, turn)
+        LATEST.pack_into(buf, HEADER.size, turn)
+
+    def read_answer(self, slot, turn) -> tuple[bool, Direction | None]:
+        """
+        Whether slot has answered turn, and with what.
+        """
+        _, answered, direction, _ = SLOT.unpack_from(self.__memory.buf, self.__slots + slot * SLOT.size)
+        if answered != turn:
+            return False, None
+        return True, DIRECTIONS[direction] if direction < len(DIRECTIONS) else None
+
+    def is_sleeping(self, slot) -> bool:
+        return bool(SLOT.unpack_from(self.__memory.buf, self.__slots + slot * SLOT.size)[3])
+
+    def close(self):
+        self.__memory.close()
+        self.__memory.unlink()
+
+class LocalTurns:
+    """
+    A bot's end: reads turns and writes answers for one slot.
+    """
+    def __init__(self, name, slot):
+        try:
+            self.__memory = SharedMemory(name=name, track=False)
+        except TypeError:
+            # before Python 3.13 attaching also registers the memory to be removed when this process exits
+            self.__memory = SharedMemory(name=name)
+            resource_tracker.unregister(self.__memory._name, "shared_memory")
+        magic, num_slots, ring_size, capacity, delta_capacity = HEADER.unpack_from(self.__memory.buf)
+        if magic != MAGIC or not 0 <= slot < num_slots:
+            self.__memory.close()
+            raise ValueError(f"{name} is not a turn buffer with slot {slot}.")
+        self.__slot = HEADER.size + LATEST.size + slot * SLOT.size
+        self.__ring = HEADER.size + LATEST.size + num_slots * SLOT.size
+        self.__ring_size = ring_size
+        self.__capacity = capacity
+        self.__entry_size = ENTRY.size + capacity + delta_capacity
+        self.__you = slot
+        self.__mirror = StateMirror()
+        self.__sleeping = False
+        self.turn = 0
+
+    def poll(self) -> dict | None:
+        """
+        The game state for the latest turn if it is newer than the last one returned, or None.
+        """
+        buf = self.__memory.buf
+        while True:
+            latest, = LATEST.unpack_from(buf, HEADER.size)
+            if latest <= self.turn or ASKED.unpack_from(buf, self.__slot)[0] != latest:
+                return None
+            entry = self.__ring + (latest % self.__ring_size) * self.__entry_size
+            turn, board_length, delta_length = ENTRY.unpack_from(buf, entry)
+            if turn != latest:
+                continue
+            start = entry + ENTRY.size
+            use_delta = delta_length and self.__mirror.turn == latest - 1
+            if not use_delta and not board_length:
+                # cannot happen unless the server thinks we answered a turn we never read; the next turn has a board
+                return None
+            try:
+                decoded = decode_delta(buf, start + self.__capacity) if use_delta else decode_board(buf, start)
+            except struct.error:
+                # the counts were read while the entry was being overwritten
+                continue
+            if ENTRY.unpack_from(buf, entry)[0] != latest:
+                continue
+            if use_delta:
+                self.__mirror.apply_delta(*decoded)
+            else:
+                grid_size, santas, gifts = decoded
+                self.__mirror.load_snapshot(latest, grid_size, self.__you, santas, gifts)
+            break
+        self.turn = latest
+        return self.__mirror.get_game_state()
+
+    def wait(self, timeout=SPIN_TIME) -> dict | None:
+        """
+        poll() until there is a new turn or timeout seconds have passed.
+        """
+        give_up = time.perf_counter() + timeout
+        while True:
+            game_state = self.poll()
+            if game_state is not None or time.perf_counter() >= give_up:
+                return game_state
+            # lets the server (or anything else waiting for the CPU) run, which matters most on a single core
+            time.sleep(0)
+
+    def set_sleeping(self, sleeping):
+        if sleeping != self.__sleeping:
+            self.__sleeping = sleeping
+            self.__memory.buf[self.__slot + SLOT.size - 1] = int(sleeping)
+
+    def answer(self, turn, direction):
+        code = NO_DIRECTION if direction is None else DIRECTIONS.index(direction)
+        # the direction goes in before the turn, so the server never sees the turn with an old direction
+        self.__memory.buf[self.__slot + ASKED.size + ANSWERED.size] = code
+        ANSWERED.pack_into(self.__memory.buf, self.__slot + ASKED.size, turn)
+
+    def close(self):
+        self.__memory.close()
@@ -0,0 +1,87 @@
+from dataclasses import dataclass
+
+from engine import Direction, step_position
+
+"""
+A cheap copy of the game for bots that want to look ahead (minimax, MCTS and so on):
+    state = SimState.from_game_state(game_state)
+    for direction in state.legal_moves(0):
+        after = state.step([direction, None, None])
+        ...
+SimStates never change, so they can be shared, kept in search trees and used as dictionary keys, and "copying" one is
+free. step() follows the same rules as Engine: every santa moves (santas that would walk off the board stay put), then
+santas standing on a gift pick it up.
+
+When two santas reach a gift together the real game gives it to whoever joined the server first, which a bot cannot
+know, so here it goes to the santa earlier in the list (you, if the state came from your game_state).
+"""
+
+@dataclass(frozen=True, slots=True)
+class SimState:
+    grid_size: tuple[int, int]
+    santas: tuple[tuple[int, int], ...]
+    gifts: frozenset[tuple[int, int]]
+    scores: tuple[int, ...]
+
+    @classmethod
+    def from_game_state(cls, game_state) -> "SimState":
+        santas = tuple(tuple(santa) for santa in game_state["santas"])
+        return cls(tuple(game_state["grid_size"]), santas, frozenset(map(tuple, game_state["gifts"])), (0,) * len(santas))
+
+    @classmethod
+    def from_engine(cls, engine) -> "SimState":
+        santas = engine.get_santas().values()
+        return cls(
+            (engine.grid_width, engine.grid_height),
+            tuple((santa.x, santa.y) for santa in santas),
+            frozenset(engine.get_gifts()),
+            tuple(santa.score for santa in santas)
+        )
+
+    def is_finished(self) -> bool:
+        return not self.gifts
+
+    def legal_moves(self, santa) -> list[Direction]:
+        """
+        The directions that actually move santa. Any direction (or None) can be sent, but the others leave it where it
+        is.
+        """
+        x, y = self.santas[santa]
+        width, height = self.grid_size
+        return [direction for direction in Direction if step_position(x, y, direction, width, height) != (x, y)]
+
+    def step(self, directions) -> "SimState":
+        """
+        The state after one turn. directions has a Direction (or None to stay put) for each santa, in the same order as
+        santas; santas past the end of it stay put.
+        """
+        width, height = self.grid_size
+        santas = list(self.santas)
+        for i, direction in enumerate(directions):
+            if direction is not None:
+                santas[i] = step_position(*santas[i], direction, width, height)
+
+        gifts = self.gifts
+        scores = self.scores
+        for i, position in enumerate(santas):
+            if position in gifts:
+                if gifts is self.gifts:
+                    gifts = set(gifts)
+                    scores = list(scores)
+                gifts.discard(position)
+                scores[i] += 1
+
+        if gifts is self.gifts:
+            return SimState(self.grid_size, tuple(santas), gifts, scores)
+        return SimState(self.grid_size, tuple(santas), frozenset(gifts), tuple(scores))
+
+    def get_game_state(self, santa=0) -> dict:
+        """
+        What take_turn would be given in this state by santa, so a bot's own take_turn can be used inside a search.
+        """
+        santas = list(self.santas)
+        return {
+            "grid_size": self.grid_size,
+            "santas": [santas[santa]] + santas[:santa] + santas[santa + 1:],
+            "gifts": list(self.gifts)
+        }
@@ -1,9 +1,14 @@
-from common import Game, Direction, SantaID, GRID_WIDTH, GRID_HEIGHT
+import argparse
+import random
+
+from common import Game, Direction, SantaID
 from edit_me import handshake, take_turn
+from profiler import add_arguments, apply_arguments
+from replay import make_replay_path
 
 class SingleplayerGame(Game):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, replay_path=None, seed=None):
+        super().__init__(replay_path=replay_path, seed=seed)
         self.__santa = SantaID("SINGLEPLAYER", handshake())
         self.__direction = None
 
@@ -29,15 +34,18 @@ class SingleplayerGame(Game):
         return True
 
     def get_santas(self) -> list[tuple[str, Direction]]:
-        game_state = {
-            "grid_size": (GRID_WIDTH, GRID_HEIGHT),
-            "santas": [self.get_santa_position("SINGLEPLAYER")],
-            "gifts": self.get_gifts()
-        }
-        return [("SINGLEPLAYER", take_turn(game_state))]
+        return [("SINGLEPLAYER", take_turn(self.get_game_state("SINGLEPLAYER")))]
 
 def main():
-    game = SingleplayerGame()
+    parser = argparse.ArgumentParser(description="Test your santa on its own.")
+    parser.add_argument("--seed", type=int, default=None, help="play the same board (and the same random choices) again")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    game = SingleplayerGame(make_replay_path(), args.seed)
+    apply_arguments(game.get_profiler(), args)
     game.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import importlib.util
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import engine
+from engine import Engine, MAX_TURNS, GRID_WIDTH, GRID_HEIGHT, NUM_GIFTS, VECTORS
+
+"""
+Plays every bot against every other bot on a pool of processes, using the headless engine. Bots are files shaped like
+edit_me.py (a handshake() and a take_turn(game_state) function), for example:
+    python tournament.py my_bot.py their_bot.py --seeds 0-999
+
+A match is decided entirely by the bots, the seed and the rules: the seed lays out the board and also seeds the random
+module before the match, so bots that use random do the same thing every time. Results are kept in a cache keyed on a
+hash of each bot file, the seed and the rules, so running the tournament again after changing one bot only plays the
+matches that bot is in. Every match gets a fresh copy of each bot, so what a bot keeps at module level does not leak
+from one match into the next. Only the bot file itself is hashed and reloaded; if a bot imports other files of yours,
+use --no-cache after changing them, and keep match state out of them. A bot that fails to load forfeits its matches
+instead of stopping the tournament, and one that raises or returns nonsense in take_turn stands still for that turn.
+"""
+
+CACHE_PATH = ".tournament_cache.sqlite"
+# bump this if the way matches are played changes in a way the engine hash would not notice
+CACHE_VERSION = 1
+
+__bot_code = dict()
+
+def load_bot(path):
+    """
+    A fresh copy of the bot in path, so nothing it keeps at module level carries over from one match to the next. The
+    file is only compiled once in each process.
+    """
+    path = os.path.abspath(path)
+    # two bots can share a file name, so the module name includes a hash of the full path
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name = f"bot_{stem}_{hashlib.sha1(path.encode()).hexdigest()[:8]}"
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    if path not in __bot_code:
+        __bot_code[path] = spec.loader.get_code(name)
+    # dataclasses and typing look the module up by name while the file runs
+    sys.modules[name] = module
+    try:
+        exec(__bot_code[path], module.__dict__)
+    finally:
+        sys.modules.pop(name, None)
+    return module
+
+def safe_turn(take_turn):
+    def wrapper(game_state):
+        try:
+            direction = take_turn(game_state)
+            return direction if direction in VECTORS else None
+        except Exception:
+            return None
+    return wrapper
+
+def forfeit_turn(game_state):
+    return None
+
+def play_match(bot_paths, seed, max_turns=MAX_TURNS) -> list[int]:
+    """
+    The score of each bot. A bot that fails to load or shake hands forfeits: its santa stands still and scores 0.
+    """
+    game = Engine(seed=seed)
+    random.seed(seed)
+    take_turns = dict()
+    forfeits = set()
+    for i, path in enumerate(bot_paths):
+        key = str(i)
+        try:
+            bot = load_bot(path)
+            name, take_turn = bot.handshake(), safe_turn(bot.take_turn)
+        except Exception:
+            forfeits.add(key)
+            name, take_turn = os.path.basename(path), forfeit_turn
+        game.add_santa(key, name)
+        take_turns[key] = take_turn
+
+    game.play(take_turns, max_turns)
+    return [0 if key in forfeits else santa.score for key, santa in game.get_santas().items()]
+
+def play_matches(matches) -> list[list[int]]:
+    return [play_match(*match) for match in matches]
+
+def parse_seeds(tokens) -> list[int]:
+    seeds = list()
+    for token in tokens:
+        if "-" in token[1:]:
+            start, end = token.split("-", 1)
+            seeds.extend(range(int(start), int(end) + 1))
+        else:
+            seeds.append(int(token))
+    return seeds
+
+def make_matches(bot_paths, seeds, players=2, max_turns=MAX_TURNS) -> list[tuple]:
+    # every seating order is played, since the first santa in the list wins any gift that two santas reach together
+    return [
+        (pairing, seed, max_turns)
+        for pairing in itertools.permutations(bot_paths, players)
+        for seed in seeds
+    ]
+
+def file_hash(path) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def rules_hash() -> str:
+    rules = [CACHE_VERSION, file_hash(engine.__file__), GRID_WIDTH, GRID_HEIGHT, NUM_GIFTS]
+    return hashlib.sha256(json.dumps(rules).encode()).hexdigest()
+
+def match_key(rules, bot_hashes, seed, max_turns) -> str:
+    return hashlib.sha256(json.dumps([rules, list(bot_hashes), seed, max_turns]).encode()).hexdigest()
+
+class ResultCache:
+    """
+    Match results on disk, keyed by match_key.
+    """
+    def __init__(self, path=CACHE_PATH):
+        self.__db = sqlite3.connect(path)
+        self.__db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, scores TEXT NOT NULL)")
+
+    def get(self, key) -> list[int] | None:
+        row = self.__db.execute("SELECT scores FROM results WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_many(self, results):
+        with self.__db:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?)", [(key, json.dumps(scores)) for key, scores in results]
+            )
+
+    def close(self):
+        self.__db.close()
+
+def run_tournament(bot_paths, seeds, players=2, workers=None, max_turns=MAX_TURNS, cache=None):
+    matches = make_matches(bot_paths, seeds, players, max_turns)
+    scores = {path: list() for path in bot_paths}
+    wins = {path: 0 for path in bot_paths}
+
+    def add_result(pairing, result):
+        for path, score in zip(pairing, result):
+            scores[path].append(score)
+        best = max(result)
+        if result.count(best) == 1:
+            wins[pairing[result.index(best)]] += 1
+
+    rules = rules_hash()
+    hashes = {path: file_hash(path) for path in bot_paths}
+    to_play = list()
+    for match in matches:
+        pairing, seed, _ = match
+        key = match_key(rules, [hashes[path] for path in pairing], seed, max_turns)
+        result = None if cache is None else cache.get(key)
+        if result is None:
+            to_play.append((key, match))
+        else:
+            add_result(pairing, result)
+
+    workers = workers or os.cpu_count() or 1
+    batch_size = max(1, min(256, len(to_play) // (workers * 4)))
+    batches = [to_play[i:i + batch_size] for i in range(0, len(to_play), batch_size)]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch, results in zip(batches, executor.map(play_matches, [[match for _, match in batch] for batch in batches])):
+            for (_, (pairing, _, _)), result in zip(batch, results):
+                add_result(pairing, result)
+            if cache is not None:
+                cache.put_many([(key, result) for (key, _), result in zip(batch, results)])
+    elapsed = time.perf_counter() - start
+
+    return scores, wins, len(to_play), len(matches) - len(to_play), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-robin tournament between bots, played headless.")
+    parser.add_argument("bots", nargs="+", help="bot files shaped like edit_me.py")
+    parser.add_argument("--seeds", nargs="+", default=["0-99"], help="seeds to play, e.g. 1 2 3 or 0-999")
+    parser.add_argument("--players", type=int, default=2, help="santas in each match")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS, help="turn limit for each match")
+    parser.add_argument("--cache", default=CACHE_PATH, help="file to keep match results in")
+    parser.add_argument("--no-cache", action="store_true", help="play every match again")
+    args = parser.parse_args()
+
+    bot_paths = [os.path.abspath(path) for path in args.bots]
+    if len(bot_paths) < args.players:
+        parser.error(f"need at least {args.players} bots")
+
+    for path in bot_paths:
+        try:
+            load_bot(path).handshake()
+        except Exception as error:
+            print(f"{os.path.basename(path)} forfeits every match, it failed to load: {error!r}")
+
+    cache = None if args.no_cache else ResultCache(args.cache)
+    try:
+        scores, wins, num_played, num_cached, elapsed = run_tournament(
+            bot_paths, parse_seeds(args.seeds), args.players, args.workers, args.max_turns, cache
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+
+    print(f"{num_played} matches in {elapsed:.2f}s ({num_played / max(elapsed, 1e-9):.1f} matches/sec), "
+          f"{num_cached} from the cache")
+    print(f"{'bot':<30}{'games':>8}{'wins':>8}{'mean':>8}{'stdev':>8}{'min':>6}{'median':>8}{'max':>6}")
+    for path in sorted(bot_paths, key=lambda p: statistics.fmean(scores[p]), reverse=True):
+        bot_scores = scores[path]
+        print(
+            f"{os.path.basename(path):<30}{len(bot_scores):>8}{wins[path]:>8}"
+            f"{statistics.fmean(bot_scores):>8.2f}{statistics.pstdev(bot_scores):>8.2f}"
+            f"{min(bot_scores):>6}{statistics.median(bot_scores):>8.1f}{max(bot_scores):>6}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import random
+
+import numpy as np
+
+from engine import Direction, SantaState, VECTORS, MAX_TURNS, GRID_WIDTH, GRID_HEIGHT, NUM_GIFTS
+
+"""
+The same game as Engine, with the board held in NumPy arrays so a turn is a handful of array operations however many
+santas there are. It is meant for huge boards (thousands of santas on 1000x1000) in tournaments and benchmarks; for a
+normal game Engine is just as fast and has no dependencies.
+
+Boards are laid out exactly as Engine lays them out for the same seed, gifts keep their order and ties go to the santa
+that was added first, so both engines hand take_turn the same game_state and play the same game.
+"""
+
+DIRECTIONS = list(Direction)
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+# dx and dy for each direction code, plus a last row for not moving
+STEPS = np.array([VECTORS[direction] for direction in DIRECTIONS] + [(0, 0)], dtype=np.int64)
+STAY = len(DIRECTIONS)
+
+class VectorEngine:
+    def __init__(self, grid_width=GRID_WIDTH, grid_height=GRID_HEIGHT, num_gifts=NUM_GIFTS, seed=None):
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.__random = random.Random(seed)
+        self.__keys: dict[str, int] = dict()
+        self.__names: list[str] = list()
+        self.__x = np.zeros(0, dtype=np.int64)
+        self.__y = np.zeros(0, dtype=np.int64)
+        self.__score = np.zeros(0, dtype=np.int64)
+
+        if num_gifts > grid_width * grid_height:
+            raise ValueError(f"Cannot fit {num_gifts} gifts on a {grid_width}x{grid_height} grid.")
+        cells = np.array(self.__random.sample(range(grid_width * grid_height), num_gifts), dtype=np.int64)
+        self.__set_gifts(cells % grid_width, cells // grid_width)
+        self.__collected: list[tuple[int, int]] = list()
+        self.__positions = None
+
+    def __set_gifts(self, xs, ys):
+        # gifts keep the order they were placed in, and each cell of the board knows which gift is on it (-1 for none)
+        self.__gift_x = np.asarray(xs, dtype=np.int64)
+        self.__gift_y = np.asarray(ys, dtype=np.int64)
+        self.__gift_alive = np.ones(len(self.__gift_x), dtype=bool)
+        self.__gift_cells = np.full((self.grid_height, self.grid_width), -1, dtype=np.int32)
+        self.__gift_cells[self.__gift_y, self.__gift_x] = np.arange(len(self.__gift_x), dtype=np.int32)
+        self.__num_gifts = len(self.__gift_x)
+        self.__gifts = None
+
+    def add_santa(self, key, name) -> SantaState:
+        random_x = self.__random.randint(0, self.grid_width - 1)
+        random_y = self.__random.randint(0, self.grid_height - 1)
+        self.__keys[key] = len(self.__names)
+        self.__names.append(name)
+        self.__x = np.append(self.__x, random_x)
+        self.__y = np.append(self.__y, random_y)
+        self.__score = np.append(self.__score, 0)
+        self.__positions = None
+        return SantaState(name, random_x, random_y)
+
+    def get_santas(self) -> dict[str, SantaState]:
+        """
+        A copy of every santa, made when asked for, so changing them does not change the game.
+        """
+        xs, ys, scores = self.__x.tolist(), self.__y.tolist(), self.__score.tolist()
+        return {
+            key: SantaState(self.__names[i], xs[i], ys[i], scores[i]) for key, i in self.__keys.items()
+        }
+
+    def get_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The x, y and score of every santa in the order they were added. Read only.
+        """
+        return self.__x, self.__y, self.__score
+
+    def get_gifts(self) -> list[tuple[int, int]]:
+        if self.__gifts is None:
+            self.__gifts = list(zip(self.__gift_x[self.__gift_alive].tolist(), self.__gift_y[self.__gift_alive].tolist()))
+        return list(self.__gifts)
+
+    def get_collected(self) -> list[tuple[int, int]]:
+        return self.__collected
+
+    def get_santa_position(self, key) -> tuple[int, int]:
+        i = self.__keys[key]
+        return int(self.__x[i]), int(self.__y[i])
+
+    def is_finished(self) -> bool:
+        return self.__num_gifts <= 0
+
+    def collect_gifts(self) -> bool:
+        gifts = self.__gift_cells[self.__y, self.__x]
+        on_gift = np.flatnonzero(gifts >= 0)
+        # np.unique gives the first santa on each gift, which is the one that joined first
+        taken, first = np.unique(gifts[on_gift], return_index=True)
+        winners = on_gift[first]
+        order = np.argsort(winners)
+        taken, winners = taken[order], winners[order]
+
+        self.__score[winners] += 1
+        self.__gift_alive[taken] = False
+        self.__gift_cells[self.__gift_y[taken], self.__gift_x[taken]] = -1
+        self.__num_gifts -= len(taken)
+        self.__collected = list(zip(self.__gift_x[taken].tolist(), self.__gift_y[taken].tolist()))
+        if len(taken):
+            self.__gifts = None
+
+        return not self.is_finished()
+
+    def move_santa(self, key, direction):
+        self.apply_directions([(key, direction)])
+
+    def move_all(self, codes):
+        """
+        Moves every santa at once. codes holds an index into DIRECTIONS for each santa in the order they were added,
+        or STAY to leave it where it is.
+        """
+        steps = STEPS[np.asarray(codes, dtype=np.int64)]
+        xs = self.__x + steps[:, 0]
+        ys = self.__y + steps[:, 1]
+        # like step_position, a santa that would walk off the board does not move at all
+        inside = (xs >= 0) & (xs < self.grid_width) & (ys >= 0) & (ys < self.grid_height)
+        self.__x = np.where(inside, xs, self.__x)
+        self.__y = np.where(inside, ys, self.__y)
+        self.__positions = None
+
+    def apply_directions(self, directions):
+        codes = np.full(len(self.__names), STAY, dtype=np.int64)
+        for key, direction in directions:
+            i = self.__keys.get(key)
+            if i is None:
+                continue
+            if codes[i] != STAY:
+                # a santa told to move twice in one turn moves twice, like in Engine
+                self.move_all(codes)
+                codes[:] = STAY
+            codes[i] = DIRECTION_CODES.get(direction, STAY)
+        self.move_all(codes)
+
+    def set_state(self, santas, gifts):
+        for i, (x, y, score) in enumerate(santas):
+            self.__x[i], self.__y[i], self.__score[i] = x, y, score
+        gifts = [tuple(gift) for gift in gifts]
+        self.__set_gifts([x for x, _ in gifts], [y for _, y in gifts])
+        self.__collected = list()
+        self.__positions = None
+
+    def get_game_state(self, key) -> dict:
+        if self.__positions is None:
+            self.__positions = list(zip(self.__x.tolist(), self.__y.tolist()))
+        i = self.__keys[key]
+        return {
+            "grid_size": (self.grid_width, self.grid_height),
+            "santas": [self.__positions[i]] + self.__positions[:i] + self.__positions[i + 1:],
+            "gifts": self.get_gifts()
+        }
+
+    def play(self, take_turns, max_turns=MAX_TURNS) -> int:
+        turns = 0
+        while self.collect_gifts() and (max_turns is None or turns < max_turns):
+            self.apply_directions([
+                (key, take_turn(self.get_game_state(key))) for key, take_turn in take_turns.items()
+            ])
+            turns += 1
+        return turns